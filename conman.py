@@ -142,6 +142,9 @@ class Launcher():
                 if value:
                     importer.fields = [x.strip() for x in value.split(',')]
                     importer.ignore_header = True
+                value = self.workflow.getint(section, 'TI_workers', fallback=0)
+                if value:
+                    importer.workers = value
             if isinstance(importer, BaseTreeImporter):
                 value = self.workflow.get(section, 'BT_keyword_attr', fallback='')
                 if value:
@@ -150,7 +153,6 @@ class Launcher():
                 value = self.workflow.get(section, 'PO_keyword_node_regex', fallback='')
                 if value:
                     importer.keyword_node_regex = value
-                    print(importer.keyword_node_regex)
                 # Read advanced values for PennOutImporter
                 value = self.workflow.get('advanced', 'PO_dump_xml', fallback='')
                 if value:
@@ -131,8 +131,27 @@ class Annotator():
             self.get_ix_from_tok(tok):
                 An integer giving token index.
         """
-        l = [x is tok for x in self.hit]
-        return l.index(True)
+        ix = self._get_ix_map().get(id(tok))
+        if ix is None or ix >= len(self.hit) or self.hit[ix] is not tok:
+            # The hit has been modified since the map was built.
+            ix = self._get_ix_map(refresh=True).get(id(tok))
+        if ix is None:
+            raise ValueError('Token is not in hit.')
+        return ix
+        
+    def _get_ix_map(self, refresh=False):
+        # Returns a dictionary mapping id(tok) to its index in self.hit,
+        # built once per hit so that index lookups are O(1).
+        try:
+            hit, d = self._ix_map
+        except AttributeError:
+            hit, d = None, {}
+        if refresh or hit is not self.hit:
+            d = {}
+            for i, x in enumerate(self.hit):
+                d.setdefault(id(x), i)
+            self._ix_map = (self.hit, d)
+        return d
         
     def get_next_tok(self, tok):
         """
@@ -278,13 +297,14 @@ class ConllAnnotator(Annotator):
         """
         i, last_id = 0, 0
         for tok in self.hit:
-            if not 'conll_ID' in tok.tags: continue
-            if int(tok.tags['conll_ID']) < last_id:
-                last_id = 0
+            tags = tok.tags
+            if not 'conll_ID' in tags: continue
+            conll_id = int(tags['conll_ID'])
+            if conll_id < last_id:
                 i += 1
-            last_id = int(tok.tags['conll_ID'])
-            tok.tags['conll_ID'] = str(i*100 + int(tok.tags['conll_ID']))
-            tok.tags['conll_HEAD'] = str(i*100 + int(tok.tags['conll_HEAD']))
+            last_id = conll_id
+            tags['conll_ID'] = str(i*100 + conll_id)
+            tags['conll_HEAD'] = str(i*100 + int(tags['conll_HEAD']))
 
 class CoreContextAnnotator(Annotator):
     """
@@ -307,30 +327,27 @@ class CoreContextAnnotator(Annotator):
         core = False
         # Compile regex
         regex = re.compile(delim_pattern)
-        # Iterate forwards, then backwards over the tokens
-        passes = []
-        for seq in [hit, reversed(hit)]:
-            l = []
-            for tok in seq:
-                # If tok is a delimiter, set core to False (end of seq)
-                if regex.fullmatch(str(tok)):
-                    # not in core...
-                    core = False
-                # ...provided it's not a kw, for which core is always True.
-                if hit.is_kw(tok):
-                    core = True
-                l.append(core)
-            passes.append(l)
-        # Reverse the second pass in place
-        passes[1].reverse()
-        # Merge into a single list of boolean values
-        bools = []
-        for pass1, pass2 in zip(passes[0], passes[1]):
-            bools.append(True) if pass1 or pass2 else bools.append(False)
-        # Make token list
+        # Classify each token once: (is delimiter, is keyword)
+        kw_ids = set(id(kw) for kw in hit.kws)
+        statuses = [
+            (bool(regex.fullmatch(str(tok))), id(tok) in kw_ids) for tok in hit
+        ]
+        # Forward pass
+        forwards = []
+        for is_delim, is_kw in statuses:
+            # If tok is a delimiter, set core to False (end of seq)...
+            if is_delim: core = False
+            # ...provided it's not a kw, for which core is always True.
+            if is_kw: core = True
+            forwards.append(core)
+        # Backward pass, merged with the forward pass to make the token list
         l = []
-        for tok, val in zip(list(hit), bools):
-            if val: l.append(tok)
+        for i in range(len(statuses) - 1, -1, -1):
+            is_delim, is_kw = statuses[i]
+            if is_delim: core = False
+            if is_kw: core = True
+            if core or forwards[i]: l.append(hit[i])
+        l.reverse()
         return l
         
 class EvaluationAnnotator(Annotator):
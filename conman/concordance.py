@@ -1,12 +1,15 @@
 #!/usr/bin/python3
 
-import collections, pickle, os.path, gzip, json
+import collections, pickle, os.path, gzip, json, sys, types
 from uuid import UUID, uuid4
 
 # This global variable is available in the whole of conman for identifying
 # valid path extensions for a concordance.
 CONCORDANCE_EXTS = ['.cnc', '.json']
 
+# Returned by Token.get_tags for tokens which have never been tagged.
+EMPTY_TAGS = types.MappingProxyType({})
+
 class Error(Exception):
     """
     Parent class for errors defined in this module.
@@ -25,7 +28,7 @@ class UUIDError(Error):
     """
     pass
 
-class Concordance(collections.UserList):
+class Concordance(list):
     """
     Class to store a concordance.
     
@@ -45,6 +48,10 @@ class Concordance(collections.UserList):
         Returns a list of UUIDs for all the Hits in the concordance in the
         order in which they are currently stored.
         
+    from_hits(cls, hits):
+        Class method creating a Concordance from a list of Hits without
+        converting them.
+        
     jsonable(self):
         Returns the Concordance in a format compatible with json.dumps().
 
@@ -59,46 +66,89 @@ class Concordance(collections.UserList):
         
                 l (list): A list of hits
         """
-        l = [make_hit(item) for item in l]
-        collections.UserList.__init__(self, l)
+        if type(l) is Concordance:
+            # Already a concordance, so its items are all hits
+            list.__init__(self, l)
+        else:
+            list.__init__(self, [make_hit(item) for item in l])
+            
+    @classmethod
+    def from_hits(cls, hits):
+        """
+        Creates a Concordance directly from hits, skipping the conversion
+        of each item with make_hit. For internal use where every item is
+        already known to be a Hit.
+        
+        Parameters:
+            hits (list): A list of Hit instances.
+            
+        Returns:
+            from_hits(cls, hits):
+                A new Concordance.
+        """
+        cnc = cls.__new__(cls)
+        list.__init__(cnc, hits)
+        return cnc
+        
+    # Compatibility with the UserList-based version of the class.
     
-    # UserList methods modified to ensure that make_hit is run on
+    @property
+    def data(self):
+        """The list of hits, i.e. the concordance itself."""
+        return self
+        
+    def __getitem__(self, i):
+        # Slices are returned as concordances, as with UserList.
+        if isinstance(i, slice):
+            return self.__class__.from_hits(list.__getitem__(self, i))
+        return list.__getitem__(self, i)
+        
+    def __setstate__(self, state):
+        # Concordances pickled when the class was a UserList store the hits
+        # under 'data' rather than as list items.
+        if 'data' in state:
+            list.extend(self, state.pop('data'))
+        self.__dict__.update(state)
+    
+    # list methods modified to ensure that make_hit is run on
     # all modifications to the concordance and that the .concordance attribute
     # is set.
     
     def __setitem__(self, i, item):
         item = make_hit(item)
         item.concordance = self
-        collections.UserList.__setitem__(self, i, item)
+        list.__setitem__(self, i, item)
         
     def append(self, item):
         item = make_hit(item)
         item.concordance = self
-        collections.UserList.append(self, item)
+        list.append(self, item)
     
     def insert(self, i, item):
         item = make_hit(item)
         item.concordance = self
-        collections.UserList.insert(self, i, item)
+        list.insert(self, i, item)
         
-    # UserList methods modified to ensure that make_concordance is run on
+    # list methods modified to ensure that make_concordance is run on
     # all additions to the concordance
     
     def __add__(self, other):
         other = make_concordance(other)
-        collections.UserList.__add__(self, other)
+        return self.__class__(list.__add__(self, other))
         
     def __radd__(self, other):
         other = make_concordance(other)
-        collections.UserList.__radd__(self, other)
+        return self.__class__(list.__add__(other, self))
         
     def __iadd__(self, other):
-        other = make_concordance(other)
-        collections.UserList.__iadd__(self, other)
+        self.extend(other)
+        return self
         
     def extend(self, other):
         other = make_concordance(other)
-        collections.UserList.extend(self, other)
+        for item in other:
+            item.concordance = self
+        list.extend(self, other)
         
     # Other methods
     
@@ -111,7 +161,7 @@ class Concordance(collections.UserList):
             get_refs(self):
                 List of refs in the order that they currently appear.
         """
-        return [hit.ref for hit in self.data]
+        return [hit.ref for hit in self]
     
     def get_uuids(self):
         """
@@ -122,13 +172,13 @@ class Concordance(collections.UserList):
             get_uuids(self):
                 List of UUIDs in the order that they currently appear.
         """
-        return [hit.uuid for hit in self.data]
+        return [hit.uuid for hit in self]
         
     def jsonable(self):
         """
         Returns the Concordance in a format compatible with json.dumps().
         """
-        return [x.jsonable() for x in self.data]
+        return [x.jsonable() for x in self]
 
     
     def save(self, path):
@@ -147,17 +197,22 @@ class Concordance(collections.UserList):
         else:
             ext = CONCORDANCE_EXTS[0]
             path += ext
-        open_fnc = gzip.open if gz else open
         open_mode = 'wt' if ext == '.json' else 'wb'
-        with open_fnc(path, open_mode) as f:
+        if gz:
+            # Level 6 compresses several times faster than gzip's default
+            # of 9 for files only a few percent larger.
+            f = gzip.open(path, open_mode, compresslevel=6)
+        else:
+            f = open(path, open_mode)
+        with f:
             if ext == '.json':
                 encoder = json.JSONEncoder(ensure_ascii=False, indent='')
                 for chunk in encoder.iterencode(self.jsonable()):
                     f.write(chunk)
             else: # Default is to use pickle
-                pickle.dump(self, f)
+                pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
     
-class Hit(collections.UserList):
+class Hit(list):
     """
     Class to store a single hit in a Concordance.
     
@@ -243,6 +298,10 @@ class Hit(collections.UserList):
     KEYWORDS = 3
     CORE_CX = 4
     
+    # Hits are numerous, so their attributes are stored in slots rather
+    # than a per-instance __dict__.
+    __slots__ = ('kws', 'core_cx', 'concordance', 'tags', 'ref', '_uuid')
+    
     def __init__(self, l = [], kws = [], uuid = None):
         """
         Constructs all attributes needed for an instance of the class.
@@ -253,8 +312,11 @@ class Hit(collections.UserList):
                 uuid :              A UUID object or something than can be
                                     used to initialize one.
         """
-        l = [make_token(s) for s in l]
-        collections.UserList.__init__(self, l)
+        if type(l) is Hit:
+            # Already a hit, so its items are all tokens
+            list.__init__(self, l)
+        else:
+            list.__init__(self, [make_token(s) for s in l])
         self.kws = kws
         self.core_cx = []
         self.concordance, self.tags, self.ref = None, {}, ''
@@ -265,60 +327,89 @@ class Hit(collections.UserList):
     def uuid(self):
         return self._uuid
         
-    # UserList methods modified to ensure that make_token is run on
+    # Compatibility with the UserList-based version of the class.
+    
+    @property
+    def data(self):
+        """The list of tokens, i.e. the hit itself."""
+        return self
+        
+    def __getitem__(self, i):
+        # Slices are returned as hits, as with UserList.
+        if isinstance(i, slice):
+            return self.__class__(list.__getitem__(self, i))
+        return list.__getitem__(self, i)
+        
+    def __getstate__(self):
+        return {
+            name: getattr(self, name) for name in self.__slots__
+            if hasattr(self, name)
+        }
+        
+    def __setstate__(self, state):
+        # Hits pickled when the class was a UserList store the tokens
+        # under 'data' rather than as list items.
+        if 'data' in state:
+            list.extend(self, state.pop('data'))
+        for name, value in state.items():
+            setattr(self, name, value)
+        
+    # list methods modified to ensure that make_token is run on
     # all modifications to the hit.
     
     def __setitem__(self, i, item):
         item = make_token(item)
-        collections.UserList.__setitem__(self, i, item)
+        list.__setitem__(self, i, item)
         
     def append(self, item):
         item = make_token(item)
-        collections.UserList.append(self, item)
+        list.append(self, item)
     
     def insert(self, i, item):
+        # .kws and .core_cx hold the tokens themselves, not indices, so
+        # there is nothing to shift when a token is inserted.
         item = make_token(item)
-        self.update_ids(i, 'insert', 1)
-        collections.UserList.insert(self, i, item)
+        list.insert(self, i, item)
         
-    # UserList methods modified to ensure that make_hit is run on
+    # list methods modified to ensure that make_hit is run on
     # all addition to the hit
     
     def __add__(self, other):
         other = make_hit(other)
-        collections.UserList.__add__(self, other)
+        return self.__class__(list.__add__(self, other))
         
     def __radd__(self, other):
         other = make_hit(other)
-        collections.UserList.__radd__(self, other)
+        return self.__class__(list.__add__(other, self))
         
     def __iadd__(self, other):
-        other = make_hit(other)
-        collections.UserList.__iadd__(self, other)
+        self.extend(other)
+        return self
         
     def extend(self, other):
-        other = make_hit(other)
-        collections.UserList.extend(self, other)
+        # Tokens are converted directly rather than through make_hit, 
+        # which would build (and give a UUID to) a throwaway Hit.
+        list.extend(self, [make_token(s) for s in other])
         
-    # UserList methods modified to ensure that deleted tokens are
+    # list methods modified to ensure that deleted tokens are
     # removed from .kws and .core_cx as well.
     
     def __delitem__(self, i):
-        self._remove_from_lists(self.data[i])
-        collections.UserList.__delitem__(self, i)
+        self._remove_from_lists(self[i])
+        list.__delitem__(self, i)
     
     def pop(self, i=-1):
-        self._remove_from_lists(self.data[i])
-        return collections.UserList.pop(self, i)
+        self._remove_from_lists(self[i])
+        return list.pop(self, i)
         
     def remove(self, item):
         self._remove_from_lists(item)
-        collections.UserList.remove(self, item)
+        list.remove(self, item)
         
     def clear(self):
         self.kws.clear()
         self.core_cx.clear()
-        collections.UserList.clear(self)
+        list.clear(self)
         
     def _remove_from_lists(self, item):
         try:
@@ -364,16 +455,19 @@ class Hit(collections.UserList):
         toks = self.get_tokens(tok_constant)
         # 2. Reverse list if finding preceding tokens
         if backwards: toks.reverse()
-        # 3. Pop first token
-        tok = toks.pop(0)
-        # 4. Scan the list until the_tok is found.
-        while toks and not tok is the_tok: tok = toks.pop(0)
-        # 5. If no toks (because tok is not found, or was the first or the last)
+        # 3. Scan the list until the_tok is found and keep the tokens after it.
+        for i, tok in enumerate(toks):
+            if tok is the_tok:
+                toks = toks[i+1:]
+                break
+        else:
+            toks = []
+        # 4. If no toks (because tok is not found, or was the first or the last)
         # return an empty list
         if not toks: return []
-        # 6. Otherwise reverse toks if we've been searching backwards
+        # 5. Otherwise reverse toks if we've been searching backwards
         if backwards: toks.reverse()
-        # 7. Return toks
+        # 6. Return toks
         return toks
     
     def get_ix(self, sf, tok_constant=0):
@@ -396,7 +490,7 @@ class Hit(collections.UserList):
             tok_a = toks[-1]
         else:
             raise Error('sf must be "start" or "end"')
-        for i, tok_b in enumerate(self.data):
+        for i, tok_b in enumerate(self):
             if tok_a is tok_b: return i
     
     def get_tokens(self, tok_constant = 0):
@@ -411,7 +505,7 @@ class Hit(collections.UserList):
                 A list of tokens
         """
         if tok_constant == self.TOKENS:
-            return [tok for tok in self.data]
+            return list(self)
         if tok_constant == self.KEYWORDS:
             return [tok for tok in self.kws]
         if tok_constant == self.CORE_CX:
@@ -420,20 +514,16 @@ class Hit(collections.UserList):
             # No context possible if there are no keywords
             return []
         if tok_constant == self.LCX:
-            l = []
-            toks = self.data[:]
-            tok = toks.pop(0)
-            while not self.is_kw(tok):
+            l, kw_ids = [], self._kw_ids()
+            for tok in self:
+                if id(tok) in kw_ids: break
                 l.append(tok)
-                tok = toks.pop(0)
             return l
         if tok_constant == self.RCX:
-            l = []
-            toks = self.data[:]
-            tok = toks.pop(-1)
-            while not self.is_kw(tok):
+            l, kw_ids = [], self._kw_ids()
+            for tok in reversed(self):
+                if id(tok) in kw_ids: break
                 l.append(tok)
-                tok = toks.pop(-1)
             l.reverse()
             return l
         return []
@@ -458,6 +548,12 @@ class Hit(collections.UserList):
             if kw is tok: return True
         return False
         
+    def _kw_ids(self):
+        # Returns the set of ids of the keyword tokens. Methods which test
+        # every token in the hit use this rather than calling is_kw each
+        # time, which scans the list of keywords.
+        return {id(kw) for kw in self.kws}
+        
     def format_token(self, tok, tok_fmt = '{0}', kw_fmt = '{0}'):
         """
         Returns a string representation of tok formatted according to 
@@ -472,7 +568,11 @@ class Hit(collections.UserList):
             format_token(self, [tok_fmt, [kw_fmt]]):
                 A string representing the token.
         """
-        if self.is_kw(tok):
+        return self._format_token(tok, self.is_kw(tok), tok_fmt, kw_fmt)
+        
+    def _format_token(self, tok, is_kw, tok_fmt, kw_fmt):
+        # Called by format_token and to_string
+        if is_kw:
             try:
                 return kw_fmt.format(tok)
             except:
@@ -532,9 +632,9 @@ class Hit(collections.UserList):
             new_tok.tags = tok.tags.copy()
             new_tok.form = ''
             l.append(new_tok)
-            for ll in [self.data, self.kws, self.core_cx]:
+            for ll in [self, self.kws, self.core_cx]:
                 if not tok in ll: continue
-                ll.insert(ll.index(tok) + 1, new_tok)
+                list.insert(ll, ll.index(tok) + 1, new_tok)
         return l
         
                 
@@ -558,8 +658,11 @@ class Hit(collections.UserList):
             to_string(self, [tok_constant, pdelimiter, [tok_fmt, [kw_fmt]]]):
                 A string representing the token.
         """
-        toks = self.get_tokens(tok_constant)
-        l = [self.format_token(tok, tok_fmt, kw_fmt) for tok in toks]
+        toks, kw_ids = self.get_tokens(tok_constant), self._kw_ids()
+        l = [
+            self._format_token(tok, id(tok) in kw_ids, tok_fmt, kw_fmt)
+            for tok in toks
+        ]
         return delimiter.join(l)
         
     def jsonable(self):
@@ -567,7 +670,7 @@ class Hit(collections.UserList):
         Returns the object in a format compatible with json.dumps.
         """
         return {
-            'data': [x.jsonable() for x in self.data], # the tokens
+            'data': [x.jsonable() for x in self], # the tokens
             'tags': make_jsonable(self.tags), # the tags dictionary
             'ref': self.ref, # the reference (string)
             'uuid': str(self._uuid), # UUID as a string
@@ -587,14 +690,23 @@ class Token(collections.UserString):
     
     Methods:
     --------
+    get_tags(self):
+        Returns the tags for reading, without creating a dictionary for an
+        untagged token.
+        
     jsonable(self):
         Returns the Token as a Python dictionary.
+        
+    set_tag(self, key, value):
+        Sets tag key to value, interning both if they are strings.
     
     Attributes:
     -----------
     
     tags : dict
-        Annotation attached to the token.
+        Annotation attached to the token. Tag names and values recur 
+        across the concordance, so should be set using set_tag or
+        intern_tags to avoid storing many copies of the same string.
         
     Property:
     ---------
@@ -606,13 +718,34 @@ class Token(collections.UserString):
     
     def __init__(self, s):
         """
-        Constructs all attributes needed for an instance of the class (tags).
+        Constructs all attributes needed for an instance of the class.
         
             Parameters:
                 s (str): String representing the token.
         """
         collections.UserString.__init__(self, s)
-        self.tags = {}
+        
+    def __setstate__(self, state):
+        # Tokens pickled before .tags became a property kept their tags
+        # under 'tags', where the property would hide them.
+        if 'tags' in state:
+            state['_tags'] = state.pop('tags')
+        self.__dict__.update(state)
+        
+    @property
+    def tags(self):
+        """The tags dictionary."""
+        # Many tokens are never tagged, so the dictionary is only created
+        # the first time it is needed.
+        try:
+            return self._tags
+        except AttributeError:
+            self._tags = {}
+            return self._tags
+            
+    @tags.setter
+    def tags(self, d):
+        self._tags = d
         
     @property
     def form(self):
@@ -630,11 +763,30 @@ class Token(collections.UserString):
     def form(self):
         del self._form
         
+    def get_tags(self):
+        """
+        Returns the tags dictionary for reading only. For a token which has
+        never been tagged, returns a shared, read-only empty mapping rather
+        than creating a dictionary as .tags does.
+        """
+        return self.__dict__.get('_tags', EMPTY_TAGS)
+        
+    def set_tag(self, key, value):
+        """
+        Sets tag key to value, interning both if they are strings.
+        
+        Parameters:
+            key (str):      The tag name.
+            value:          The tag value.
+        """
+        self.tags[sys.intern(key)] = \
+            sys.intern(value) if type(value) is str else value
+        
     def jsonable(self):
         """
         Returns the object in a format compatible with json.dumps.
         """
-        d = {'data': self.data, 'tags': self.tags}
+        d = {'data': self.data, 'tags': self.__dict__.get('_tags', {})}
         try:
             d['_form'] = self._form
         except AttributeError:
@@ -671,16 +823,17 @@ def _load_json(path, gz):
     open_fnc = gzip.open if gz else open
     with open_fnc(path, 'rt') as f:
         l = json.load(f)
-    cnc = make_concordance([])
+    hits = []
+    l.reverse() # so that hits can be popped from the end
     while l: # save memory
-        json_hit = l.pop(0)
+        json_hit = l.pop()
         # Rebuild Token list
         toks = [
             Token(x['data']) for x in json_hit['data']
         ]
         # Rebuild Token attributes
         for i, tok in enumerate(toks):
-            tok.tags = json_hit['data'][i]['tags']
+            tok.tags = intern_tags(json_hit['data'][i]['tags'])
             try:
                 tok._form = json_hit['data'][i]['_form']
             except KeyError:
@@ -695,8 +848,11 @@ def _load_json(path, gz):
         hit.ref = json_hit['ref']
         # Add tags
         hit.tags = json_hit['tags']
-        # Append to cnc
-        cnc.append(hit)
+        hits.append(hit)
+    # Build cnc from the hits in one go
+    cnc = Concordance.from_hits(hits)
+    for hit in cnc:
+        hit.concordance = cnc
     # Return cnc
     return cnc
     
@@ -712,7 +868,8 @@ def make_concordance(l):
         make_concordance(l):
             An instance of the Concordance class.
     """
-    if isinstance(l, Concordance): return l
+    # Exact type check first: cheaper than isinstance for the usual case
+    if type(l) is Concordance or isinstance(l, Concordance): return l
     cnc = Concordance(l)
     return cnc
     
@@ -737,6 +894,25 @@ def make_jsonable(obj):
     # 5. Return the object as it is.
     return obj
 
+def intern_tags(d):
+    """
+    Function to intern the keys and string values of a tags dictionary,
+    so that tag names and common values (e.g. pos tags) are shared across 
+    the concordance rather than stored once per token.
+    
+    Parameters:
+        d (dict): A tags dictionary.
+        
+    Returns:
+        intern_tags(d):
+            A new dictionary with interned keys and string values.
+    """
+    intern = sys.intern
+    return {
+        intern(key): intern(value) if type(value) is str else value
+        for key, value in d.items()
+    }
+
 def make_hit(l, kws = []):
     """
     Function to convert a list or list-like object into a valid Hit instance.
@@ -749,7 +925,8 @@ def make_hit(l, kws = []):
         make_hit(l, kws):
             An instance of the Hit class.
     """
-    if isinstance(l, Hit): return l
+    # Exact type check first: cheaper than isinstance for the usual case
+    if type(l) is Hit or isinstance(l, Hit): return l
     hit = Hit(l, kws)
     return hit
     
@@ -806,7 +983,8 @@ def make_token(s):
         make_token(s):
             An instance of the Token class.
     """
-    if isinstance(s, Token): return s
+    # Exact type check first: cheaper than isinstance for the usual case
+    if type(s) is Token or isinstance(s, Token): return s
     tok = Token(s)
     return tok
    
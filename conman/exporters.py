@@ -2,6 +2,9 @@
 
 import csv, os.path
 
+# Dialect for tab-separated files, registered once when the module is loaded.
+csv.register_dialect('tab', delimiter='\t', quoting=csv.QUOTE_NONE)
+
 class Error(Exception):
     """
     Parent class for errors defined in this module.
@@ -22,6 +25,10 @@ class Exporter():
     
     Attributes:
     -----------
+    buffer_size (int):
+        Size in bytes of the buffer used to write the exported file. Default
+        is 1 MiB.
+        
     encoding (str):
         Name of codec to use to write the exported file. Default is utf-8.
         
@@ -69,6 +76,7 @@ class Exporter():
         Constructs all attributes needed for an instance of the class.
         """
         self.encoding = 'utf-8'
+        self.buffer_size = 1 << 20
         self.kw_fmt = '{0.form}'
         self.core_cx = False
         self.split_hits = 0
@@ -164,7 +172,7 @@ class Exporter():
             path (str):                     File name
             encoding (str):                 Character encoding
         """
-        with open(path, 'w', encoding=self.encoding, errors='replace') as f:
+        with open(path, 'w', encoding=self.encoding, errors='replace', buffering=self.buffer_size) as f:
             for hit in cnc:
                 s = hit.to_string(
                     hit.CORE_CX if self.core_cx else hit.TOKENS,
@@ -219,7 +227,7 @@ class TokenListExporter(Exporter):
             cnc (concordance.Concordance):  Concordance to export
             path (str):                     File name
         """
-        with open(path, 'w', encoding=self.encoding, errors='replace') as f:
+        with open(path, 'w', encoding=self.encoding, errors='replace', buffering=self.buffer_size) as f:
             for hit in cnc:
                 s = hit.to_string(
                     hit.CORE_CX if self.core_cx else hit.TOKENS,
@@ -257,7 +265,7 @@ class LGermExporter(TokenListExporter):
             cnc (concordance.Concordance):  Concordance to export
             path (str):                     File name
         """
-        with open(path, 'w', encoding=self.encoding, errors='replace') as f:
+        with open(path, 'w', encoding=self.encoding, errors='replace', buffering=self.buffer_size) as f:
             for hit in cnc:
                 toks = self.get_tokens(hit)
                 for tok in toks:
@@ -322,11 +330,6 @@ class TableExporter(Exporter):
         self.header = True
         self.dialect = 'excel'
         self.fields = []
-        csv.register_dialect(
-            'tab',
-            delimiter='\t',
-            quoting=csv.QUOTE_NONE
-            )
         self.exts = ['csv', 'tsv']
         
     def _set_default_fields(self, cnc):
@@ -348,7 +351,7 @@ class TableExporter(Exporter):
             encoding (str):                 Character encoding
         """
         if not self.fields: self._set_default_fields(cnc)
-        with open(path, 'w', encoding=self.encoding, errors='replace', newline='') as f:
+        with open(path, 'w', encoding=self.encoding, errors='replace', newline='', buffering=self.buffer_size) as f:
             writer = csv.writer(f, dialect=self.dialect)
             if self.header:
                 writer.writerow(self.fields)
@@ -416,6 +419,9 @@ class ConllExporter(Exporter):
     get_feats(self, tok):
         Returns a string for the feats column of the Conll table.
         
+    hit_to_lines(self, hit):
+       Generator yielding the lines of the Conll table for the hit.
+        
     hit_to_string(self, hit): 
        Returns a string representing the Conll table for the hit.
        
@@ -446,12 +452,14 @@ class ConllExporter(Exporter):
             path (str)                   : Path for Conll file.
             add_refs (bool)              : Boolean
         """
-        with open(path, 'w', encoding=self.encoding, errors='replace') as f:
+        with open(path, 'w', encoding=self.encoding, errors='replace', buffering=self.buffer_size) as f:
             for hit in cnc:
                 if add_refs:
                     f.write('# ' + str(hit.uuid) + '\n')
                     f.write('# ' + hit.ref + '\n')
-                f.write(self.hit_to_string(hit))
+                # Rows are written as they are made rather than joined
+                # into a string for the whole hit.
+                f.writelines(self.hit_to_lines(hit))
                 f.write('\n')
     
     def hit_to_string(self, hit):
@@ -465,13 +473,23 @@ class ConllExporter(Exporter):
             hit_to_string(self, hit):
                 Returns a string representing the Conll table for the hit.
         """
-        s = ''
+        return ''.join(self.hit_to_lines(hit))
+        
+    def hit_to_lines(self, hit):
+        """
+        Generator yielding the lines of the Conll table for each hit, each
+        ending with a newline.
+        
+        Parameters:
+            hit (concordance.Hit)   : a Hit object
+        """
+        tok_to_list = self.tok_to_list
         toks = self.get_tokens(hit)
         for ix, tok in enumerate(toks):
             if tok.form: # Possible agglutination
                 span = hit.get_form_span(tok)
                 if span > 1: # Definite agglutination
-                    s += '\t'.join([
+                    yield '\t'.join([
                         str(ix) + '-' + str(ix + span - 1),    # 1. ID
                         tok.form,                              # 2. form
                         '_',                                   # 3. lemma
@@ -484,15 +502,13 @@ class ConllExporter(Exporter):
                         '_',                                   # 10. pdeprel
                     ]) + '\n'
             # Continue processing the token
-            s += '\t'.join(self.tok_to_list(tok, ix + 1)) + '\n'
+            yield '\t'.join(tok_to_list(tok, ix + 1)) + '\n'
         if self.hit_end_token:
-            s += '\t'.join([
+            yield '\t'.join([
                 str(ix + 2), #1
                 self.hit_end_token, #2
                 '_', '_', '_', '_', '0', 'root', '_', '_' 
-            ])
-            s += '\n'
-        return s
+            ]) + '\n'
         
     def get_feats(self, tok):
         """
@@ -506,11 +522,11 @@ class ConllExporter(Exporter):
             get_feats(self, tok):
                 A string suitable for the FEATS column in Conll
         """
-        l = []
-        for feat in self.feats:
-            if feat in tok.tags:
-                l.append('{}={}'.format(feat, tok.tags[feat]))
-        return '|'.join(l)
+        if not self.feats: return ''
+        tags = tok.get_tags()
+        return '|'.join(
+            f'{feat}={tags[feat]}' for feat in self.feats if feat in tags
+        )
         
     def tok_to_list(self, tok, ix):
         """
@@ -539,17 +555,22 @@ class ConllExporter(Exporter):
         # 9. phead (tok.tags[self.phead] or '_')
         # 10. pdeprel (tok.tags[self.pdeprel] or '_')
         
+        tags = tok.get_tags() # doesn't create tags for untagged tokens
+        if not tags:
+            # Every column but the first two takes its default value.
+            return [str(ix), str(tok), '_', '_', '_', '_', '0', 'root', '_', '_']
+        get = tags.get
         return [
-            str(ix),                                                  # 1. ID
-            str(tok),                                                 # 2. form
-            tok.tags[self.lemma] if self.lemma in tok.tags else '_',  # 3. lemma
-            tok.tags[self.cpostag] if self.cpostag in tok.tags else '_',  # 4. cpostag
-            tok.tags[self.postag] if self.postag in tok.tags else '_',  # 5. postag
-            self.get_feats(tok) or '_',                                  # 6. feats
-            str(tok.tags[self.head]) if self.head in tok.tags else '0',    # 7. head
-            tok.tags[self.deprel] if self.deprel in tok.tags else 'root', # 8. deprel
-            tok.tags[self.phead] if self.phead in tok.tags else '_',  # 9. phead
-            tok.tags[self.pdeprel] if self.pdeprel in tok.tags else '_',  # 10. pdeprel
+            str(ix),                                # 1. ID
+            str(tok),                               # 2. form
+            get(self.lemma, '_'),                   # 3. lemma
+            get(self.cpostag, '_'),                 # 4. cpostag
+            get(self.postag, '_'),                  # 5. postag
+            self.get_feats(tok) or '_',             # 6. feats
+            str(get(self.head, '0')),               # 7. head
+            get(self.deprel, 'root'),               # 8. deprel
+            get(self.phead, '_'),                   # 9. phead
+            get(self.pdeprel, '_'),                 # 10. pdeprel
         ]
        
 def get_exporter_from_path(path):
@@ -5,7 +5,15 @@ from conman.tokenizers import *
 from uuid import uuid4
 import treetools.basetree, treetools.syn_importer, treetools.transformers
 import conman.scripts.pennout2cnc
-import copy, csv, glob, json, re, os.path
+import concurrent.futures, copy, csv, glob, itertools, json, re, os.path
+
+# Default token regex: the whole token string is the word.
+WORD_REGEX = r'(?P<word>.*)'
+# Number of rows TableImporter sends to a worker process at a time.
+ROW_BATCH_SIZE = 1000
+
+# Dialect for tab-separated files, registered once when the module is loaded.
+csv.register_dialect('tab', delimiter='\t', quoting=csv.QUOTE_NONE)
 
 class Error(Exception):
     """
@@ -30,6 +38,9 @@ class Importer():
     concordance (concordance.Concordance):
         Concordance object
         
+    buffer_size (int):
+        Size in bytes of the buffer used to read the file. Default is 1 MiB.
+        
     encoding (str):
         Text encoding to use for reading the file. Default is 'utf-8'.
         
@@ -85,8 +96,15 @@ class Importer():
         Parses a token string into fields using the regex. The key "word" is
         reserved for the form of the token.
         
+    parse_tokens(self, l, special_field):
+        Converts a list of token strings into a list of tokens, using the
+        regex.
+        
     tokenize(self, s):
         Uses self.tokenizer to tokenize a multi-word field.
+        
+    tokenize_many(self, texts):
+        Uses self.tokenizer to tokenize several multi-word fields at once.
     
     """
     
@@ -117,15 +135,29 @@ class Importer():
         """
         self.concordance = Concordance([])
         self.encoding = 'utf-8'
+        self.buffer_size = 1 << 20
         self.lcx_regex, self.keywds_regex, self.rcx_regex = \
-            r'(?P<word>.*)', r'(?P<word>.*)', r'(?P<word>.*)' 
+            WORD_REGEX, WORD_REGEX, WORD_REGEX
         self.ref_regex = ''
         self.tokenizer = Tokenizer()
         self._on_token_parse_error = 'drop'
         
+    @property
+    def ref_regex(self):
+        """The regex used by parse_ref."""
+        return self._ref_regex
+        
+    @ref_regex.setter
+    def ref_regex(self, s):
+        # The regex is compiled once here since parse_ref is called for
+        # every hit.
+        self._ref_regex = s
+        self._ref_pattern = re.compile(s) if s else None
+        
     def _handle_token_parse_error(self, s, regex):
         # What to do when a string is encountered that the regex can't
         # process
+        if isinstance(regex, re.Pattern): regex = regex.pattern
         msg = "Can't identify the token in '{}', regex '{}'".format(s, regex)
         if self._on_token_parse_error == 'raise':
             raise ParseError(msg)
@@ -151,16 +183,43 @@ class Importer():
             get_tokens(self, s, special_field):
                 A list of concordance.Tokens.
         """
-        l = self.tokenize(s)
+        return self.parse_tokens(self.tokenize(s), special_field)
+        
+    def parse_tokens(self, l, special_field):
+        """
+        Converts a list of token strings, as returned by the tokenizer, into
+        a list of tokens, using the regex.
+        
+        Parameters:
+            l (list) :          A list of token strings
+            special_field (str):One of the special fields in SPECIAL_FIELDS
+                                which selects the right regex.
+                                
+        Returns:
+            parse_tokens(self, l, special_field):
+                A list of concordance.Tokens.
+        """
         if special_field in ['LCX', 'TOKENS']:
-            result = [self.parse_token(item, self.lcx_regex) for item in l]
+            regex = self.lcx_regex
         if special_field.startswith('KEYWORDS'):
-            result = [self.parse_token(item, self.keywds_regex) for item in l]
+            regex = self.keywds_regex
         if special_field == 'RCX':
-            result = [self.parse_token(item, self.rcx_regex) for item in l]
-        while Token('') in result:
-            result.remove(Token(''))
-        return result
+            regex = self.rcx_regex
+        # The whole field is parsed in one pass, then the empty tokens 
+        # (unparsable strings) are dropped in a second.
+        parse_token = self.parse_token
+        if regex == WORD_REGEX:
+            # The default regex makes the whole string the word with no
+            # tags, so it need only be run where '.' could stop at a 
+            # newline.
+            result = [
+                parse_token(item, regex) if '\n' in item else Token(item)
+                for item in l
+            ]
+        else:
+            regex = re.compile(regex)
+            result = [parse_token(item, regex) for item in l]
+        return [tok for tok in result if tok.data]
             
     def parse(self, path, delimiter = '\n'):
         """
@@ -179,7 +238,7 @@ class Importer():
             parse(self, path, [encoding, [delimiter]]):
                 A concordance object.
         """
-        with open(path, 'r', encoding=self.encoding, errors='replace') as f:
+        with open(path, 'r', encoding=self.encoding, errors='replace', buffering=self.buffer_size) as f:
             s = ''
             for line in f:
                 s += line
@@ -219,20 +278,25 @@ class Importer():
         Parameters:
             s (str):        A string representing a token
             regex (str):    A regex mapping the token string to fields, one
-                            of which must be 'word'.
+                            of which must be 'word'. May also be given
+                            as a compiled re.Pattern.
         
         Returns:
             parse_token(self, s, regex):
                 A concordance.Token instance.
         """
-        m = re.match(regex, s)
-        if not m or m and not 'word' in m.groupdict():
+        # Callers parsing many tokens compile the regex once beforehand.
+        if isinstance(regex, re.Pattern):
+            m = regex.match(s)
+        else:
+            m = re.match(regex, s)
+        d = m.groupdict() if m else {}
+        if not 'word' in d:
             tok = self._handle_token_parse_error(s, regex)
             tok.tags = {}
         else: # Successful parse
-            tok = Token(m.groupdict()['word'])
-            tok.tags = dict([(key, value) for key, value in m.groupdict().items()])
-            tok.tags.pop('word')
+            tok = Token(d.pop('word'))
+            tok.tags = intern_tags(d)
         return tok
         
     def parse_ref(self, ref):
@@ -247,8 +311,8 @@ class Importer():
             parse_ref(self, ref):
                 A dictionary of metadata.
         """
-        if not self.ref_regex: return {}
-        m = re.match(self.ref_regex, ref)
+        if not self._ref_pattern: return {}
+        m = self._ref_pattern.match(ref)
         if m:
             return m.groupdict()
         else:
@@ -271,6 +335,24 @@ class Importer():
         except:
             print(s)
             raise
+            
+    def tokenize_many(self, texts):
+        """
+        Calls tokenize_many method of self.tokenizer to tokenize each string
+        in texts.
+    
+        Parameters:
+            texts (list) : List of strings containing tokens
+        
+        Return:
+            tokenize_many(self, texts):
+              A list of lists of tokens, one for each string
+        """
+        try:
+            return self.tokenizer.tokenize_many(texts)
+        except:
+            print(texts)
+            raise
 
 class BaseTreeImporter(Importer):
     """
@@ -361,7 +443,7 @@ class BaseTreeImporter(Importer):
         tok = Token(elem.getAttribute('value'))
         attrs.remove('value')
         # 3. Store all other attributes as tok.tags
-        tok.tags = dict(zip(attrs, [elem.getAttribute(attr) for attr in attrs]))
+        tok.tags = intern_tags(dict(zip(attrs, [elem.getAttribute(attr) for attr in attrs])))
         # 4. Return Token
         return tok
         
@@ -639,7 +721,7 @@ class GrewMatchImporter(Importer):
             for key, value in self.parse_ref(hit.ref).items():
                 hit.tags[key] = value
             try:
-                hit.kws = [hit.data[kw_ix]]
+                hit.kws = [hit[kw_ix]]
             except:
                 print(hit)
                 print(hit_src)
@@ -744,12 +826,20 @@ class TableImporter(Importer):
         UUID:       unique ID
         TOKENS:     Tokens
         
+    workers (int):
+        Number of processes used to parse the rows. Only worthwhile for
+        large files, since each batch of hits must be sent back from the
+        worker. Default is 1, i.e. parse in this process.
+        
     Methods:
     --------
     
     parse(self, path, encoding = 'utf-8'):
         Parses a CSV file.
         
+    parse_iter(self, path):
+        Generator which parses a CSV file, yielding one Hit per row.
+        
     parse_hit(self, row):
         Parses a row from the CSV file. Returns a Hit object.
         
@@ -765,11 +855,7 @@ class TableImporter(Importer):
         self.ignore_header = False
         self.dialect = 'excel'
         self.fields = ['REF', 'LCX', 'KEYWORDS', 'RCX']
-        csv.register_dialect(
-            'tab',
-            delimiter='\t',
-            quoting=csv.QUOTE_NONE
-            )
+        self.workers = 1
             
     def parse(self, path):
         """
@@ -783,19 +869,58 @@ class TableImporter(Importer):
             parse(self, path, [encoding, [header]]):
                 A concordance object.
         """
-        with open(path, 'r', encoding=self.encoding, errors='replace', newline='') as f:
-            reader = csv.reader(f, self.dialect)
+        append = self.concordance.append
+        for hit in self.parse_iter(path):
+            append(hit)
+        return self.concordance
+        
+    def parse_iter(self, path):
+        """
+        Generator which parses a CSV file, yielding one Hit per row without
+        adding it to self.concordance. The file is read as the hits are 
+        consumed, so an exporter can write a large file without the whole
+        concordance being held in memory.
+        
+        Parameters:
+            path (str):     Path to the CSV or text file.
+        """
+        with open(path, 'r', encoding=self.encoding, errors='replace', newline='', buffering=self.buffer_size) as f:
+            if self.dialect == 'tab':
+                # Without quoting, each line can simply be split on tabs,
+                # which is faster than going through the csv module.
+                reader = split_tab_lines(f)
+            else:
+                reader = csv.reader(f, self.dialect)
         # Skip the first row if header is True
             if self.has_header:
-                header_row = reader.__next__()
+                header_row = next(reader, None)
+                if header_row is None: return # empty file
                 if not self.ignore_header: 
                     self.fields = header_row
                 elif not self.fields:
                     raise ParseError("No column names given. Set importer.fields or importer.header = True.")
-            for row in reader:
-                hit = self.parse_hit(row)
-                self.concordance.append(hit)
-        return self.concordance
+            if self.workers > 1:
+                yield from self._parse_rows_in_pool(reader)
+            else:
+                parse_hit = self.parse_hit
+                for row in reader:
+                    yield parse_hit(row)
+                    
+    def _parse_rows_in_pool(self, reader):
+        # Parses the rows in batches in a pool of self.workers processes,
+        # yielding the hits in the order of the rows. The workers are sent
+        # a copy of the importer without the concordance (or a sniffed
+        # dialect, which can't be pickled).
+        worker = copy.copy(self)
+        worker.concordance, worker.dialect = Concordance([]), None
+        batches = iter(lambda: list(itertools.islice(reader, ROW_BATCH_SIZE)), [])
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as executor:
+            while True:
+                # Only read a couple of batches per worker ahead.
+                window = list(itertools.islice(batches, self.workers * 2))
+                if not window: break
+                for hits in executor.map(parse_rows, itertools.repeat(worker), window):
+                    yield from hits
         
     def parse_hit(self, row):
         """
@@ -809,7 +934,7 @@ class TableImporter(Importer):
                 A Hit object.
                 
         """
-        uuid, ref, d = None, '', dict()
+        uuid, ref, d, tok_fields = None, '', dict(), []
         # Parse the fields
         for key, value in zip(self.fields, row):
             if key in self.SPECIAL_FIELDS or key.startswith('KEYWORDS'):
@@ -818,9 +943,14 @@ class TableImporter(Importer):
                 elif key == 'REF':
                     ref = value
                 else:
-                    d[key] = self.get_tokens(value, key)
+                    d[key] = None # Placeholder, filled in below
+                    tok_fields.append((key, value))
             else:
                 d[key] = value
+        # Tokenize all the token fields in the row in one call
+        tok_lists = self.tokenize_many([value for key, value in tok_fields])
+        for (key, value), l in zip(tok_fields, tok_lists):
+            d[key] = self.parse_tokens(l, key)
         # Create list of all tokens
         #print(d)
         # Check for KEYWORDS split over several columns and rewrite
@@ -910,8 +1040,9 @@ class TokenListImporter(Importer):
         parse(self, path):
             A concordance object
         """     
-        with open(path, 'r', encoding=self.encoding, errors='replace') as f:
+        with open(path, 'r', encoding=self.encoding, errors='replace', buffering=self.buffer_size) as f:
             d, l = {}, []
+            regex = re.compile(self.lcx_regex)
             for line in f:
                 if self.comment_string and line.startswith(self.comment_string):
                     # send to comment parser
@@ -919,7 +1050,7 @@ class TokenListImporter(Importer):
                     # next line
                     continue
                 if line[:-1]:
-                    tok = self.parse_token(line[:-1], self.lcx_regex)
+                    tok = self.parse_token(line[:-1], regex)
                 else:
                     tok = Token('')
                 if tok and tok != self.hit_end_token: 
@@ -1119,9 +1250,10 @@ def context_to_list(lcx, keywds, rcx):
     # Check that keywds contains Tokens rather than strings, since the
     # Hit object will check object identity.
     keywds = [make_token(item) for item in keywds]
-    l = lcx + keywds + rcx
-    kws = [keywd for keywd in keywds]
-    return l, kws
+    # The sentence is built as a single list rather than by concatenating
+    # twice. keywds is already a new list, so it serves as kws.
+    l = [*lcx, *keywds, *rcx]
+    return l, keywds
     
 def get_importer_from_path(path):
     """
@@ -1188,15 +1320,47 @@ def parse_json(path):
         return json.load(f)
     
     
-def tags_to_tok(tags, tagnames = [], word_tag='word'):
+def parse_rows(importer, rows):
+    """
+    Parses a list of rows from a table using importer.parse_hit. Used by
+    TableImporter to parse rows in worker processes.
+    
+    Parameters:
+        importer (TableImporter) : The importer to use
+        rows (list)              : List of rows, each a list of fields
+        
+    Returns:
+        parse_rows(importer, rows):
+            A list of Hit objects.
+    """
+    parse_hit = importer.parse_hit
+    return [parse_hit(row) for row in rows]
+    
+def split_tab_lines(f):
+    """
+    Generator which splits each line of a tab-separated file into a list of
+    fields. Gives the same rows as a csv.reader using the 'tab' dialect, 
+    including an empty list for a blank line. The file must be opened with
+    newline=''.
+    
+    Parameters:
+        f (file) : The open file
+    """
+    for line in f:
+        line = line.rstrip('\r\n')
+        yield line.split('\t') if line else []
+    
+def tags_to_tok(tags, tagnames = (), word_tag='word'):
     """
     Converts a list of tags to a token using the names in tagnames.
     
     Parameters:
         tags (list)       : List of tags
-        tagnames (list)   : List of tagnames to attach to the tags (optional).
-                            If no tagnames are given or the length doesn't
-                            match 'tag1', 'tag2' etc. will be generated.
+        tagnames (list)   : List or tuple of tagnames to attach to the tags 
+                            (optional). It is only read, so one schema can
+                            be shared by all tokens. If no tagnames are 
+                            given or the length doesn't match 'tag1', 'tag2'
+                            etc. will be generated.
         word_tag (str)    : Tag to use for the form of the word.
                             Default is 'word' or the first item, if no 
                             tagnames are given.
@@ -1205,20 +1369,15 @@ def tags_to_tok(tags, tagnames = [], word_tag='word'):
         tags_to_tok(tags, [tagnames, [word_tag]]):
             A token instance.
     """
-    def get_tagname():
-        nonlocal i
-        s = 'tag' + str(i)
-        i += 1
-        return s
-        
-    i = 1
-    tagnames = tagnames[:] # COPY tagnames since the pop method is used.
     form, tag_d = '', {}
     # If tagnames is NOT passed, use the first tag as the form.
-    if not tagnames: form = tags.pop(0)
+    if not tagnames: form, tags = tags[0], tags[1:]
+    # Tags beyond the end of tagnames are named 'tag1', 'tag2' etc.
+    names = itertools.chain(
+        tagnames, ('tag' + str(i) for i in itertools.count(1))
+    )
     # Iterate over tags
-    for tag in tags:
-        tagname = tagnames.pop(0) if tagnames else get_tagname()
+    for tagname, tag in zip(names, tags):
         if tagname == word_tag:
             form = tag
         else:
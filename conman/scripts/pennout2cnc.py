@@ -50,11 +50,18 @@ def script(transformer, tree,
                 raise
             return nodes[0] if nodes else None
         
-    def is_head(leaf, ic):
-        nonlocal tree
+    def get_head_cached(ic, heads):
+        # As get_head, but memoized in the dictionary heads, keyed by
+        # id(ic). heads must be discarded if the tree is modified.
+        try:
+            return heads[id(ic)]
+        except KeyError:
+            head = heads[id(ic)] = get_head(ic)
+            return head
+        
+    def is_head(leaf, ic, heads):
         # Returns True if leaf is the head of this constituent.
-        # Convoluted expression finds all descendent leaves
-        return True if leaf is get_head(ic) else False  
+        return get_head_cached(ic, heads) is leaf
     
     ################################
     # 1. Deal with the comment node
@@ -133,12 +140,15 @@ def script(transformer, tree,
     ####################################################################
     # 4. Project all branch_attrs, except relation, on to the leaf.
     ####################################################################
-    attrs = list(set(tree.branch_attrs) - set(tree.leaf_attrs) - set(['relation']))
-    for attr in attrs:
-        tree.add_leaf_attr(attr)
+    # Single pass in branch_attrs order so the result is deterministic.
+    leaf_attr_set = set(tree.leaf_attrs)
+    attrs = tuple(attr for attr in tree.branch_attrs 
+        if attr not in leaf_attr_set and attr != 'relation')
+    tree.add_leaf_attrs(attrs)
     for leaf in tree.leaves:
+        branch = leaf.parentNode
         for attr in attrs:
-            leaf.setAttribute(attr, leaf.parentNode.getAttribute(attr))
+            leaf.setAttribute(attr, branch.getAttribute(attr))
     
     #######################################################################
     # 5. Create ancestors and ancestors_cs_id attribute (records hierarchy)
@@ -222,18 +232,26 @@ def script(transformer, tree,
     # else is the first word in the constituent.
     ###################################################################
     
-    tree.add_leaf_attr('conll_HEAD')    
+    tree.add_leaf_attr('conll_HEAD')
+    # The structure isn't modified in this step, so the head of each
+    # constituent need only be found once.
+    heads, head_orders = {}, {}
     for leaf in tree.leaves:
         ic = leaf.parentNode.parentNode
-        while is_head(leaf, ic) and ic.parentNode is not tree.trunk:
+        while is_head(leaf, ic, heads) and ic.parentNode is not tree.trunk:
             ic = ic.parentNode
-        if is_head(leaf, ic):
+        if is_head(leaf, ic, heads):
             # Head is sentence root
             leaf.setAttribute('conll_HEAD', '0')
         else:
-            head = get_head(ic)
-            if head:
-                leaf.setAttribute('conll_HEAD', str(head.getAttribute('order')))
+            try:
+                head_order = head_orders[id(ic)]
+            except KeyError:
+                head = get_head_cached(ic, heads)
+                head_order = head_orders[id(ic)] = \
+                    head.getAttribute('order') if head else None
+            if head_order is not None:
+                leaf.setAttribute('conll_HEAD', head_order)
             
     ###################################################################
     # 8. Use the word-lemma regex to split the tokens.
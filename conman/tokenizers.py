@@ -1,6 +1,35 @@
 #!/usr/bin/python3
 
-import re
+import functools, re
+
+try:
+    # Optional: google-re2 matches in linear time, so malformed input can't
+    # cause catastrophic backtracking in the token regexes.
+    import re2 as token_re
+except ImportError:
+    token_re = re
+
+# Whitespace splitter used by all tokenizers, compiled once.
+WS_REGEX = re.compile(r'\s+')
+# Splitter used by the base Tokenizer. Only ASCII whitespace separates
+# tokens, so that non-breaking and thin spaces (e.g. before ; : ! ? in
+# French) stay inside the token.
+ASCII_WS_REGEX = re.compile(r'[ \t\n\r\f\v]+')
+
+# The characters matched by re's \s, for use in the character classes of
+# the token regexes. re2's \s only matches ASCII whitespace, so \s itself
+# would tokenize differently depending on which module is installed.
+WS_CHARS = '\t-\r\x1c- \x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000'
+
+# If re2 still doesn't split non-ASCII whitespace like re, use re.
+_WS_SAMPLE = 'a\xa0b\u2009c\u3000d\x85e\u2028f\x1cg h'
+if token_re is not re and token_re.findall('[^' + WS_CHARS + ']+', _WS_SAMPLE) \
+    != re.findall(r'\S+', _WS_SAMPLE):
+    token_re = re
+
+# Translation table used by the MidiaTokenizer to treat the midpoint (and its
+# C1 control code counterpart) as whitespace.
+MIDPOINT_TO_SPACE = str.maketrans({'\u00b7': ' ', '\u0095': ' '})
 
 class Error(Exception):
     """
@@ -16,7 +45,8 @@ class ParseError(Error):
 
 class Tokenizer():
     """
-    Parent class used to tokenize strings in hits. Divides by whitespace.
+    Parent class used to tokenize strings in hits. Divides by ASCII
+    whitespace; non-breaking and other Unicode spaces stay in the token.
     
     Attributes:
     -----------
@@ -26,6 +56,9 @@ class Tokenizer():
     
     tokenize(self, s):
         Tokenizes s, returning a list of tokens.
+        
+    tokenize_many(self, texts):
+        Tokenizes each string in texts, returning a list of lists of tokens.
     """
     
     def __init__(self):
@@ -36,17 +69,11 @@ class Tokenizer():
         """
         Creates an instance of tokenizer_type and returns it.
         """
-        
-        TOKENIZER_TYPE_TO_CLASS_MAP = {
-          'Tokenizer':  Tokenizer,
-          'BfmTokenizer': BfmTokenizer,
-          'TxmFrenchTokenizer': TxmFrenchTokenizer,
-          'FrantextTokenizer': FrantextTokenizer,
-          'MidiaTokenizer': MidiaTokenizer
-        }
-        if tokenizer_type not in TOKENIZER_TYPE_TO_CLASS_MAP:
-              raise ValueError('Bad tokenizer type {}'.format(tokenizer_type))
-        return TOKENIZER_TYPE_TO_CLASS_MAP[tokenizer_type]()
+        try:
+            tokenizer_class = TOKENIZER_TYPE_TO_CLASS_MAP[tokenizer_type]
+        except KeyError:
+            raise ValueError('Bad tokenizer type {}'.format(tokenizer_type))
+        return tokenizer_class()
     
     def tokenize(self, s):
         """
@@ -59,7 +86,25 @@ class Tokenizer():
             tokenize(self, s):
               A list of tokens
         """
-        return s.split(' ')
+        # Runs of ASCII whitespace count as a single separator, so no 
+        # empty tokens are returned. Unicode spaces such as NBSP are part
+        # of the token.
+        return [x for x in ASCII_WS_REGEX.split(s) if x]
+        
+    def tokenize_many(self, texts):
+        """
+        Tokenizes each string in texts, returning a list of lists of tokens.
+        Used by the importers to tokenize all the fields in a hit at once.
+    
+        Parameters:
+            texts (list) : List of strings containing tokens
+        
+        Return:
+            tokenize_many(self, texts):
+              A list of lists of tokens, one for each string
+        """
+        tokenize = self.tokenize
+        return [tokenize(s) for s in texts]
         
 class BfmTokenizer(Tokenizer):
     """
@@ -76,8 +121,14 @@ class BfmTokenizer(Tokenizer):
     """
     
     def __init__(self):
-        self.token_regex_multi = r"[^_\s'(]*[^_\s'(),.!´][(']?|[,.)!]|,!|,´"
-        self.token_regex = r"[^\s'(]*[^_\s'(),.!´][(']?|[,.)!]|,!|,´"
+        # A token is a run of characters ending in one which isn't closing
+        # punctuation, optionally followed by ( or '. The run is written as
+        # repeated (closing punctuation)* + (other character) groups, which
+        # don't overlap, so the regex never needs to backtrack.
+        self.token_regex_multi = r"(?:[),.!´]*[^_" + WS_CHARS + \
+            r"'(),.!´])+[(']?|[,.)!]|,!|,´"
+        self.token_regex = r"(?:[_),.!´]*[^_" + WS_CHARS + \
+            r"'(),.!´])+[(']?|[,.)!]|,!|,´"
     
     def tokenize(self, s):
         """
@@ -90,20 +141,18 @@ class BfmTokenizer(Tokenizer):
             tokenize(self, s):
               A list of tokens
         """
-        def remove_empty(l):
-            while '' in l:
-                l.remove('')
-            return l
         # Tokenizing from the BFM is hard because whitespace is occasionally
         # suppressed, but tags can also be added.
         # Step 0: sanity check: if s is an empty string or contains only
         # whitespace, return an empty list
         if not s or s.isspace(): return []
-        # Step 1: Identify how many underscores each token contains
-        l = re.split(r'\s+', s)
-        l = remove_empty(l)
-        parts_per_tok = [len(re.findall(r'_', x)) for x in l]
-        parts = min(parts_per_tok) # The minimum number of underscores in a token
+        # Step 1: Identify how many underscores each token contains. If
+        # there are none at all, there's no need to split the string.
+        if '_' in s:
+            l = [x for x in WS_REGEX.split(s) if x]
+            parts = min(x.count('_') for x in l) # The minimum number of underscores in a token
+        else:
+            parts = 0
         # Step 2: Generate regex to identify a token from the number of
         # parts before the underscore plus a sophisticated regex to identify
         # the end of the token.
@@ -118,24 +167,23 @@ class BfmTokenizer(Tokenizer):
             # Necessary because there are occasional tokens containing
             # spaces in the BFM :-(
             r = self.token_regex
-        regex = re.compile(r)
-        # Step 3: Tokenize using re.match on the string.
+        # Each match is either a token (group 1) or, where the token regex
+        # fails, everything up to the next space (group 2), followed by any
+        # whitespace. Every position is therefore covered by some match, so
+        # finditer walks the whole string in a single pass.
+        regex = get_token_regex(r'(?:(' + r + r')|([^ ]+))[' + WS_CHARS + ']*')
+        # Step 3: Tokenize using regex.finditer on the string.
         toks = []
-        s = s.lstrip().rstrip() # Strip trailing and preceding whitespace.
-        while s:
-            m = regex.match(s)
-            if not m: 
-                print("Warning: Can't tokenize {}".format(s, r))
+        s = s.strip() # Strip trailing and preceding whitespace.
+        for m in regex.finditer(s):
+            tok = m.group(1)
+            if tok is None: 
+                print("Warning: Can't tokenize {}".format(s[m.start():], r))
                 print("Last token: {}".format(toks[-1] if toks else ''))
-                # start again from next whitespace or end, if it's the last
-                # token.
                 # everything preceding next w/s considered to be 
                 # a token
-                toks.append(s.split(' ', maxsplit=1)[0])
-                s = s[s.index(' ') + 1:] if ' ' in s else ''
-            else:
-                toks.append(m.group(0))
-            s = s[len(toks[-1]):].lstrip() # remove whitespace
+                tok = m.group(2)
+            toks.append(tok)
         return toks
         
 class TxmFrenchTokenizer(BfmTokenizer):
@@ -144,8 +192,10 @@ class TxmFrenchTokenizer(BfmTokenizer):
     """
     
     def __init__(self):
-        self.token_regex_multi = r"[^\s_,.\[\]\(\)!']*\.?[^\s_,.\[\]\(\)!']'?|[,.\[\]\(\)!']|,!|,´"
-        self.token_regex = r"[^\s_,.\[\]\(\)!']*\.?[^\s_,.\[\]\(\)!']'?|[,.\[\]\(\)!']|,!|,´"
+        nonspace = '[^' + WS_CHARS + r"_,.\[\]\(\)!']"
+        self.token_regex_multi = nonspace + r"*\.?" + nonspace + \
+            r"'?|[,.\[\]\(\)!']|,!|,´"
+        self.token_regex = self.token_regex_multi
 
 class FrantextTokenizer(Tokenizer):
     """
@@ -172,10 +222,6 @@ class FrantextTokenizer(Tokenizer):
             tokenize(self, s):
               A list of tokens
         """
-        def remove_empty(l):
-            while '' in l:
-                l.remove('')
-            return l
         # Tokenizing from FRANTEXT would be straightforward except that
         # tokens and lemmas can contain whitespace, which is really annoying.
         # The Tokenizer makes *all* w/s into token delimiters.
@@ -185,12 +231,12 @@ class FrantextTokenizer(Tokenizer):
         if not s or s.isspace(): return []
         # Step 1: Identify how many slashes each token contains. We assume,
         # with all due caution, that slash itself is always a special character
-        l = re.split(r'\s+', s)
-        l = remove_empty(l)
-        parts_per_tok = [len(re.findall(r'/', x)) for x in l]
+        l = [x for x in WS_REGEX.split(s) if x]
+        parts_per_tok = [x.count('/') for x in l]
         parts_per_tok.sort()
         parts = parts_per_tok[len(parts_per_tok) // 2] # Median (more or less)
-        regex = re.compile(r'[^\s/]+/' * parts + r'[^\s/]+')
+        nonspace = '[^' + WS_CHARS + '/]+'
+        regex = get_token_regex((nonspace + '/') * parts + nonspace)
         # Step 2: Iterate over the whitespace delimited tokens in s and try to
         # attach all slash-less tokens to an appropriate token with slashes,
         # assuming that (i) lemmas with spaces are more common than tokens with
@@ -199,8 +245,11 @@ class FrantextTokenizer(Tokenizer):
         toks = []
         strays_left, strays_right = [], []
         for grp in l:
-            m = regex.match(grp)
-            if m:
+            # Counting slashes is much cheaper than running the regex and
+            # rejects most strays outright. The regex is still needed to
+            # confirm the rest, since it also requires each part to be
+            # non-empty (e.g. 'a//b' has enough slashes but doesn't match).
+            if grp.count('/') >= parts and regex.match(grp):
                 # First, deal with strays
                 if strays_right:
                     # we have a match but singletons preceded it
@@ -259,8 +308,9 @@ class MidiaTokenizer(Tokenizer):
             tokenize(self, s):
               A list of tokens
         """
-        # 
-        return re.split(r'[\s·]+', s)
+        # Map the midpoint characters to spaces so that str.split does all
+        # the work in a single pass.
+        return s.translate(MIDPOINT_TO_SPACE).split()
     
 
         
@@ -275,4 +325,28 @@ class MidiaTokenizer(Tokenizer):
             
         
     
+
+# Maps the tokenizer names used in workflow files to classes. Used by
+# Tokenizer.create.
+TOKENIZER_TYPE_TO_CLASS_MAP = {
+  'Tokenizer':  Tokenizer,
+  'BfmTokenizer': BfmTokenizer,
+  'TxmFrenchTokenizer': TxmFrenchTokenizer,
+  'FrantextTokenizer': FrantextTokenizer,
+  'MidiaTokenizer': MidiaTokenizer
+}
         
+@functools.lru_cache(maxsize=64)
+def get_token_regex(r):
+    """
+    Returns the compiled regex for pattern r, compiling it only the first
+    time the pattern is requested. Uses google-re2 if it is installed.
+    
+    Parameters:
+        r (str) : A regex pattern
+        
+    Returns:
+        get_token_regex(r):
+            A compiled regex.
+    """
+    return token_re.compile(r)
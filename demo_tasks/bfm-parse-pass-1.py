@@ -1,10 +1,10 @@
 #!/usr/bin/python3
 
-import argparse, os, os.path, sys
+import argparse, os, os.path, subprocess, sys
 
-def run(cmd):
+def run(argv):
     """Runs a command and checks exit status"""
-    status = os.waitstatus_to_exitcode(os.system(cmd))
+    status = subprocess.run(argv).returncode
     if status != 0:
         sys.exit(status)
 
@@ -16,9 +16,9 @@ def main(infile, outfile, workflow):
     else:
         wf_path = os.path.join(conman_path, 'workflows', 'wf_bfm2conllu.cfg')
     print('Calling ConMan')    
-    s = ' '.join([conman_call, '-s', '-w', wf_path, infile, outfile])
-    print(s)
-    run(s)
+    argv = [sys.executable, conman_call, '-s', '-w', wf_path, infile, outfile]
+    print(' '.join(argv))
+    run(argv)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
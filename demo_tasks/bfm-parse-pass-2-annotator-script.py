@@ -1,4 +1,6 @@
 #!/usr/bin/python3
+import bisect, functools, re
+
 def script(annotator, hit):
     
     # Subroutines to parse the structure
@@ -13,32 +15,21 @@ def script(annotator, hit):
         """
         Returns all child toks of parent.
         """
-        l = []
-        for tok in hit:
-            if not 'conll_ID' in tok.tags: continue
-            try:
-                if int(tok.tags['conll_HEAD']) == int(parent.tags['conll_ID']):
-                    l.append(tok)
-            except:
-                print(hit)
-                print(tok)
-                print(tok.tags)
-                raise
-        return l
+        return list(children_of.get(conll_ids[id(parent)], []))
         
     def get_descendents(parent):
         """
         Returns all descendent toks of parent.
         """
-        l, newl, i = [], [parent], 0
-        while newl and i < 1000:
-            i += 1
-            toks = newl
-            newl = []
-            for tok in toks:
-                newl += get_children(tok)
-            l += newl
-        l.sort(key=lambda x: int(x.tags['conll_ID']))
+        l, stack, seen = [], [parent], {id(parent)}
+        while stack:
+            for tok in children_of.get(conll_ids[id(stack.pop())], []):
+                # seen guards against cycles in malformed parses
+                if id(tok) in seen: continue
+                seen.add(id(tok))
+                l.append(tok)
+                stack.append(tok)
+        l.sort(key=lambda x: conll_ids[id(x)])
         return l
         
     def get_lemma(tok, var):
@@ -46,8 +37,9 @@ def script(annotator, hit):
         Returns the lemma matching the form of token from the key: regex
         dictionary in var.
         """
-        for lemma, pattern in var.items():
-            if re.fullmatch(pattern, str(tok).lower()):
+        form = str(tok).lower()
+        for lemma, regex in compile_var(tuple(var.items())):
+            if regex.fullmatch(form):
                 return lemma
         return ''
         
@@ -56,22 +48,39 @@ def script(annotator, hit):
         Returns the parent and all dominated nodes as a string.
         """
         tree = get_descendents(parent)
-        tree.append(parent)
-        tree.sort(key=lambda x: int(x.tags['conll_ID']))
+        # tree is already sorted, so only the parent needs placing
+        keys = [conll_ids[id(x)] for x in tree]
+        tree.insert(bisect.bisect_right(keys, conll_ids[id(parent)]), parent)
         return ' '.join([str(x) for x in tree])
         
     # First, reset the Conll IDs, since each hit is a series of small trees
     # Otherwise the search algorithm will get very muddled indeed
     i, last_id = 0, 0
     for tok in hit:
-        if not 'conll_ID' in tok.tags: continue
-        if int(tok.tags['conll_ID']) < last_id:
-            last_id = 0
+        tags = tok.tags
+        if not 'conll_ID' in tags: continue
+        conll_id = int(tags['conll_ID'])
+        if conll_id < last_id:
             i += 1
-        last_id = int(tok.tags['conll_ID'])
-        tok.tags['conll_ID'] = str(i*100 + int(tok.tags['conll_ID']))
-        tok.tags['conll_HEAD'] = str(i*100 + int(tok.tags['conll_HEAD']))
+        last_id = conll_id
+        tags['conll_ID'] = str(i*100 + conll_id)
+        tags['conll_HEAD'] = str(i*100 + int(tags['conll_HEAD']))
         # print(tok.tags)
+        
+    # Index the trees once per hit: parse each conll_ID and conll_HEAD a
+    # single time and map each head ID to its children, so that
+    # get_children doesn't have to rescan the whole hit.
+    conll_ids, children_of = {}, {}
+    for tok in hit:
+        if not 'conll_ID' in tok.tags: continue
+        try:
+            conll_ids[id(tok)] = int(tok.tags['conll_ID'])
+            children_of.setdefault(int(tok.tags['conll_HEAD']), []).append(tok)
+        except:
+            print(hit)
+            print(tok)
+            print(tok.tags)
+            raise
     
     # Main procedure
     kw = get_kw(hit)
@@ -90,3 +99,10 @@ def script(annotator, hit):
     
     return hit
 
+@functools.lru_cache(maxsize=None)
+def compile_var(items):
+    """
+    Compiles the patterns in a tuple of (lemma, pattern) pairs, caching the
+    result so that each var is only compiled once.
+    """
+    return tuple((lemma, re.compile(pattern)) for lemma, pattern in items)
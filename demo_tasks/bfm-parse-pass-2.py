@@ -1,10 +1,10 @@
 #!/usr/bin/python3
 
-import argparse, os, os.path, sys
+import argparse, os, os.path, subprocess, sys
 
-def run(cmd):
+def run(argv):
     """Runs a command and checks exit status"""
-    status = os.waitstatus_to_exitcode(os.system(cmd))
+    status = subprocess.run(argv).returncode
     if status != 0:
         sys.exit(status)
 
@@ -15,10 +15,10 @@ def main(infile, mergefile, outfile, workflow):
         wf_path = os.path.join(os.getcwd(), workflow)
     else:
         wf_path = os.path.join(conman_path, 'workflows', 'wf_bfm-merge-conllu.cfg')
-    s = ' '.join([conman_call, '-w', wf_path, '-m', mergefile, infile, outfile])
+    argv = [sys.executable, conman_call, '-w', wf_path, '-m', mergefile, infile, outfile]
     print('Calling ConMan')
-    print(s)
-    run(s)
+    print(' '.join(argv))
+    run(argv)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -1,10 +1,10 @@
 #!/usr/bin/python3
 
-import argparse, os, os.path, sys
+import argparse, os, os.path, subprocess, sys
 
-def run(cmd):
+def run(argv):
     """Runs a command and checks exit status"""
-    status = os.waitstatus_to_exitcode(os.system(cmd))
+    status = subprocess.run(argv).returncode
     if status != 0:
         sys.exit(status)
 
@@ -15,10 +15,10 @@ def main(infile, outfile, workflow):
         wf_path = os.path.join(os.getcwd(), workflow)
     else:
         wf_path = os.path.join(conman_path, 'workflows', 'wf_pennout2csv.cfg')
-    s = ' '.join([conman_call, '-w', wf_path, infile, outfile])
+    argv = [sys.executable, conman_call, '-w', wf_path, infile, outfile]
     print('Calling conman')
-    print(s)
-    run(s)
+    print(' '.join(argv))
+    run(argv)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -28,10 +28,9 @@ if __name__ == '__main__':
         )
     parser.add_argument('infile', help='Input .out file.')
     parser.add_argument('outfile', help='Output .csv file.')
-    parser.add_argument('-w', '--workflow', nargs=1, default=[''],
+    parser.add_argument('-w', '--workflow', nargs='?', default='',
         help='Workflow configuration file.')
     
     # Convert Namespace to dict.
     args = vars(parser.parse_args())
-    workflow = args.pop('workflow')[0] if 'workflow' in args else ''
-    main(args.pop('infile'), args.pop('outfile'), workflow)
+    main(args.pop('infile'), args.pop('outfile'), args.pop('workflow'))
@@ -6,7 +6,12 @@
 # © Tom Rainsford, ILR, Universität Stuttgart, 2022-                  #
 #######################################################################
 
-import re, csv, sys, argparse
+import re, csv, os, sys, argparse, concurrent.futures, itertools
+
+# Cache used by merge_mapping, keyed by id(mapping).
+MERGED_MAPPINGS = {}
+# Number of rows process_csv reads into memory at a time.
+CSV_BATCH_SIZE = 10000
 
 class LgermFilterer():
     """
@@ -15,63 +20,71 @@ class LgermFilterer():
     """
 
     # Mappings from Alexei's Perl script. The order is important.
+    # The regexes are compiled once here rather than on every call to _get_stn.
     MAPPING_LGERM = [
-        (r'(\(\?\|loc|préf|suff)$', ['OUT']),
-        (r'adj\., adv\. et subst\. masc', ['APD', 'ADV', 'NOMcom']),
-        (r'adj\. et adv\.', ['APD', 'ADV']), # CORRECTED
-        (r'adj\. et subst\.', ['APD', 'NOMcom']),
-        (r'adv\., prép\. et subst', ['ADV','PRE','NOMcom']),
-        (r"adv\. (d'intensité)? et conj", ['ADV','CON']),
-        (r'adv\. et prép', ['ADV', 'PRE']),
-        (r'adv\. et subst', ['ADV', 'NOMcom']),
-        (r'art', ['DET']),
-        (r'pron\. pers\.', ['PRO']),
-        (r'(adj|dém|indéf|interr|num|poss|pron|rel\. interr)', ['APD']),
-        (r'adv', ['ADV']),
-        (r'conj', ['CON']),
-        (r'interj', ['INJ']),
-        (r'mot lat', ['ETR']),
-        (r'(nom de lieu|nom propre)', ['NOMpro']),
-        (r'(part|verbe)', ['VER']),
-        (r'ponctuation', ['PON']),
-        (r'prép\. et adv\.', ['PRE', 'ADV']),
-        (r'prép\.', 'PRE'),
-        (r'quantif', ['ADV', 'APD']),
-        (r'subst\. et adj\.', ['NOMcom', 'APD']),
-        (r'subst\. et adv\.', ['NOMcom', 'ADV']),
-        (r'subst', ['NOMcom', 'NOMpro'])
+        (re.compile(r'(\(\?\|loc|préf|suff)$'), ['OUT']),
+        (re.compile(r'adj\., adv\. et subst\. masc'), ['APD', 'ADV', 'NOMcom']),
+        (re.compile(r'adj\. et adv\.'), ['APD', 'ADV']), # CORRECTED
+        (re.compile(r'adj\. et subst\.'), ['APD', 'NOMcom']),
+        (re.compile(r'adv\., prép\. et subst'), ['ADV','PRE','NOMcom']),
+        (re.compile(r"adv\. (d'intensité)? et conj"), ['ADV','CON']),
+        (re.compile(r'adv\. et prép'), ['ADV', 'PRE']),
+        (re.compile(r'adv\. et subst'), ['ADV', 'NOMcom']),
+        (re.compile(r'art'), ['DET']),
+        (re.compile(r'pron\. pers\.'), ['PRO']),
+        (re.compile(r'(adj|dém|indéf|interr|num|poss|pron|rel\. interr)'), ['APD']),
+        (re.compile(r'adv'), ['ADV']),
+        (re.compile(r'conj'), ['CON']),
+        (re.compile(r'interj'), ['INJ']),
+        (re.compile(r'mot lat'), ['ETR']),
+        (re.compile(r'(nom de lieu|nom propre)'), ['NOMpro']),
+        (re.compile(r'(part|verbe)'), ['VER']),
+        (re.compile(r'ponctuation'), ['PON']),
+        (re.compile(r'prép\. et adv\.'), ['PRE', 'ADV']),
+        (re.compile(r'prép\.'), 'PRE'),
+        (re.compile(r'quantif'), ['ADV', 'APD']),
+        (re.compile(r'subst\. et adj\.'), ['NOMcom', 'APD']),
+        (re.compile(r'subst\. et adv\.'), ['NOMcom', 'ADV']),
+        (re.compile(r'subst'), ['NOMcom', 'NOMpro'])
     ]
     
     # Mappings from Alexei's Perl script. The order is important.
     MAPPING_CATTEX = [
-        (r'ABR|OUT|RED|RES', 'OUT'),
-        (r'DETdef|DETndf', 'DET'),
-        (r'PROper', 'PRO'),
-        (r'ADJ|DET|PRO', 'APD'),
-        (r'ADV', 'ADV'),
-        (r'CON', 'CON'),
-        (r'ETR', 'ETR'),
-        (r'INJ', 'INJ'),
-        (r'NOMcom', 'NOMcom'),
-        (r'NOMpro', 'NOMpro'),
-        (r'PON', 'PON'),
-        (r'PRE', 'PRE'),
-        (r'VER', 'VER')
+        (re.compile(r'ABR|OUT|RED|RES'), 'OUT'),
+        (re.compile(r'DETdef|DETndf'), 'DET'),
+        (re.compile(r'PROper'), 'PRO'),
+        (re.compile(r'ADJ|DET|PRO'), 'APD'),
+        (re.compile(r'ADV'), 'ADV'),
+        (re.compile(r'CON'), 'CON'),
+        (re.compile(r'ETR'), 'ETR'),
+        (re.compile(r'INJ'), 'INJ'),
+        (re.compile(r'NOMcom'), 'NOMcom'),
+        (re.compile(r'NOMpro'), 'NOMpro'),
+        (re.compile(r'PON'), 'PON'),
+        (re.compile(r'PRE'), 'PRE'),
+        (re.compile(r'VER'), 'VER')
     ]
     
     # Frequent lemmas from Alexei's Perl script.
-    FREQUENT_LEMMAS = set([
+    FREQUENT_LEMMAS = frozenset([
         'AVOIR1', 'ÊTRE1', 'DEVOIR2', 'TOUT2', 'PART1', 'SEIGNEUR', 
         'PRENDRE', 'FEMME', 'ROI1', 'SI3', 'AMI', 'VOULOIR', 'DIEU'
     ])
     
     def _get_stn(self, pos, mapping):
         # runs regex, converts pos to standardized tag, returning it.
-        for pattern, stn in mapping:
-             m = re.match(pattern, pos)
-             if m: return stn
+        # All the regexes in the mapping are tried in a single match, and
+        # since the same tags recur constantly, the result is memoized.
+        regex, stns, results = merge_mapping(mapping)
+        try:
+            return results[pos]
+        except KeyError:
+            pass
+        m = regex.match(pos)
         # if this procedure fails, return the tag unchanged
-        return pos
+        stn = stns[m.lastgroup] if m else pos
+        results[pos] = stn
+        return stn
            
     def filter_lemmas(self, form, pos, lgerm_out, mapping_pos, mapping_lgerm):
         """
@@ -87,11 +100,11 @@ class LgermFilterer():
         lgerm_out (str):
             The output string from the LGeRM lemmatizer.
         mapping_pos (list):
-            A list of (regex, str) tuples to be applied to the pos tag.
+            A list of (compiled regex, str) tuples to be applied to the pos tag.
             The str gives an internal, standard pos tags which
             will be used to compare the pos tag with the LGeRM tag.
         mapping_lgerm (list):
-            A list of (regex, list) tuples to be applied to the LGeRM tags.
+            A list of (compiled regex, list) tuples to be applied to the LGeRM tags.
             The list specifies a list of internal, standard pos tags which
             will be matched against the standard pos tag.
             
@@ -109,8 +122,6 @@ class LgermFilterer():
         # Iterate over the LGeRM lemmas and their standardized POS tags
         lemmas = []
         #print(lgerm_stns)
-        if form == 'on':
-            print(lgerm_tups, lgerm_stns, pos_stn)
         for lgerm_tup, lgerm_stn in zip(lgerm_tups, lgerm_stns):
             # lgerm_stn is still a list of possible tags for this one
             # lemma. So if one matches, it's a possible lemma. Add to 
@@ -140,44 +151,79 @@ class LgermFilterer():
         """
         tups = []
         for pairs in lgerm_out.split('|'):
-            l = pairs.split('@')
-            if len(l) == 2: 
-                tups.append((l[0], l[1], []))
-            elif len(l) > 2: # extra fields are (presumably) LGeRM rules
-                tups.append((l[0], l[1], l[2:]))
-            else:
+            lemma, sep, rest = pairs.partition('@')
+            if not sep:
                 print("Warning: Can't parse {}".format(pairs))
+                continue
+            pos, sep, rules = rest.partition('@')
+            # extra fields are (presumably) LGeRM rules
+            tups.append((lemma, pos, rules.split('@') if sep else []))
         return tups
     
-    def process_csv(self, infile, outfile):
+    def process_csv(self, infile, outfile, workers=1):
         """
         Runs the disambiguator on a CSV file, which must contain the
         following columns:
             - word (the form)
             - cattex_pos (the pos tag)
             - lgerm_out (unprocessed verb-pos pairings from LGeRM)
+            
+        If workers is greater than 1, the rows are processed in a pool 
+        of that many worker processes.
         """
-        # Load
+        # Rows are streamed from infile to outfile in batches, using
+        # the column indices found in the header.
         with open(infile, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            header = reader.fieldnames
+            reader = csv.reader(f)
+            header = next(reader, [])
             for field in ['word', 'cattex_pos', 'lgerm_out']:
                 if not field in header:
                     print("Field {} missing in csv, aborting".format(field))
                     sys.exit(2)
-            table = [x for x in reader]
-        # Process, filter + refine
-        for d in table:
-            l = self.filter_lemmas(
-                d['word'], d['cattex_pos'], d['lgerm_out'],
-                self.MAPPING_CATTEX, self.MAPPING_LGERM
-            )
-            d['lgerm_filtered'] = '|'.join(self.refine_lemmas(l))
-        # Write the file
-        with open(outfile, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames = header + ['lgerm_filtered'])
-            writer.writeheader()
-            writer.writerows(table)
+            ix_word, ix_pos, ix_out = [
+                header.index(field) 
+                for field in ['word', 'cattex_pos', 'lgerm_out']
+            ]
+            rows = (row for row in reader if row) # blank lines, as in DictReader
+            # Opening outfile truncates it, so if it is infile the whole 
+            # table must be read first.
+            if os.path.exists(outfile) and os.path.samefile(infile, outfile):
+                rows = iter(list(rows))
+            executor = concurrent.futures.ProcessPoolExecutor(workers) \
+                if workers > 1 else None
+            try:
+                with open(outfile, 'w', newline='', encoding='utf-8') as f_out:
+                    writer = csv.writer(f_out)
+                    writer.writerow(header + ['lgerm_filtered'])
+                    # Process, filter + refine. The same word, tag and 
+                    # LGeRM output recur many times in a corpus, so each
+                    # combination is only processed once.
+                    results = {}
+                    while True:
+                        batch = list(itertools.islice(rows, CSV_BATCH_SIZE))
+                        if not batch: break
+                        keys = [(row[ix_word], row[ix_pos], row[ix_out]) for row in batch]
+                        # dict rather than set to keep the order of the rows
+                        new_keys = list(dict.fromkeys(
+                            key for key in keys if not key in results
+                        ))
+                        if executor:
+                            filtered = executor.map(self._process_key, new_keys,
+                                chunksize=len(new_keys) // (workers * 4) + 1)
+                        else:
+                            filtered = map(self._process_key, new_keys)
+                        results.update(zip(new_keys, filtered))
+                        writer.writerows(
+                            row + [results[key]] for row, key in zip(batch, keys)
+                        )
+            finally:
+                if executor: executor.shutdown()
+                
+    def _process_key(self, key):
+        # filters and refines the lemmas for a (word, cattex_pos, lgerm_out)
+        # tuple, returning the string for the lgerm_filtered column.
+        l = self.filter_lemmas(*key, self.MAPPING_CATTEX, self.MAPPING_LGERM)
+        return '|'.join(self.refine_lemmas(l))
                  
     def refine_lemmas(self, lemmas,
         lower_case=True,
@@ -206,35 +252,72 @@ class LgermFilterer():
             A list of lemmas following the refinement process.
         """
         
-        def strip_numbers(l):
+        def strip(l):
             # strips numbers from a list of lemmas if and when necessary
-            nonlocal strip_numbers        
             if not strip_numbers: return l
-            l2 = []
-            while l:
-                s = l.pop(0)
-                l2.append(s[:-1] if s[-1].isnumeric() else s)
-            l2 = list(set(l2))
-            l2.sort()
-            return l2
+            return sorted({s[:-1] if s[-1:].isnumeric() else s for s in l})
             
         if prioritize_frequent:
             # Get the union of the set of frequent lemmas and the set
             # of lemmas
-            st = set(lemmas) & self.FREQUENT_LEMMAS
+            s = set(lemmas)
+            st = s & self.FREQUENT_LEMMAS
             if st:
                 # add parentheses to infrequent lemmas            
-                st2 = set(lemmas) - self.FREQUENT_LEMMAS
-                lemmas = strip_numbers(list(st)) + ['(' + x + ')' for x in strip_numbers(list(st2))]
+                st2 = s - st
+                lemmas = strip(list(st)) + ['(' + x + ')' for x in strip(list(st2))]
             else:
-                lemmas = strip_numbers(lemmas)
+                lemmas = strip(lemmas)
         else:
-            lemmas = strip_numbers(lemmas)
+            lemmas = strip(lemmas)
         if lower_case:
             # convert to lower case
             lemmas = [x.lower() for x in lemmas]
         return lemmas
             
+def merge_mapping(mapping):
+    """
+    Merges the regexes in a mapping into a single regex in which each is
+    a named group, tried in the order given. Mappings are treated as 
+    constant, so the result is cached along with a dictionary in which
+    _get_stn memoizes its results, seeded with the literal tags.
+    
+    Parameters:
+    
+    mapping (list):
+        A list of (compiled regex, stn) tuples.
+        
+    Returns:
+    
+    merge_mapping(mapping):
+        A (compiled regex, dict, dict) tuple. The first dict maps each
+        group name to its stn; the second is the memo of results.
+    """
+    try:
+        cached_mapping, merged = MERGED_MAPPINGS[id(mapping)]
+    except KeyError:
+        pass
+    else:
+        if cached_mapping is mapping: return merged
+    groups, stns = [], {}
+    for i, (x, stn) in enumerate(mapping):
+        name = 'g{}'.format(i)
+        groups.append('(?P<{}>{})'.format(name, x.pattern))
+        stns[name] = stn
+    regex, results = re.compile('|'.join(groups)), {}
+    # Tags spelt out literally in the mapping (e.g. 'NOMcom', or each 
+    # branch of 'DETdef|DETndf') are looked up now, so the memo already
+    # holds them. The merged regex decides, since the order is important.
+    for pattern in (x.pattern for x, stn in mapping):
+        for literal in pattern.split('|'):
+            if literal and re.escape(literal) == literal:
+                m = regex.match(literal)
+                results[literal] = stns[m.lastgroup] if m else literal
+    merged = (regex, stns, results)
+    # Keep a reference to the mapping so that its id can't be reused.
+    MERGED_MAPPINGS[id(mapping)] = (mapping, merged)
+    return merged
+    
 # Test launch data
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -246,8 +329,11 @@ if __name__ == '__main__':
     parser.add_argument('infile', help='Input file to import.')
     parser.add_argument('outfile', help='Output file to export.',
         nargs='?', default='out.csv')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+        help='Number of worker processes (default 1).')
         
     # Convert Namespace to dict.    
     args = vars(parser.parse_args())
     filterer = LgermFilterer()
-    filterer.process_csv(args.pop('infile'), args.pop('outfile'))
+    filterer.process_csv(args.pop('infile'), args.pop('outfile'),
+        args.pop('processes'))
@@ -4,10 +4,11 @@
 # Python 3.1
 
 import xml.dom.minidom
+import xml.parsers.expat
 import xml.sax.handler
 import xml.sax
-import collections
-import re, random, pickle
+import array, collections, contextlib
+import bisect, re, pickle
 
 legal_relations = [ \
 ('tree', 'trunk'), \
@@ -41,6 +42,24 @@ default_tree_string = \
   <trunk/>
 </tree>"""
 
+# Regexes used to read terminals and tree IDs from a StringTree without
+# parsing it. A terminal's id, order and value are read from its start tag,
+# whatever order the attributes are in.
+terminal_regex = re.compile(r'<(leaf|knot)\s[^>]*>')
+terminal_attr_regex = re.compile(r'\s(id|order|value)\s*=\s*"([^"]*)"')
+tree_id_regex = re.compile(r'<tree[^>]*\sid="([^"]+)"')
+# Matches a whole terminal of a flat tree, capturing its order.
+flat_terminal_regex = re.compile(
+    r'<(leaf|knot)[^>]*\sorder="(\d+)".*?(/>|</leaf>|</knot>)', re.DOTALL
+)
+# Used by StringTree.get_id and StringTree.update_id.
+get_id_regex = re.compile(r'(?<=tree\sid=)"(.*?)"')
+update_id_regex = re.compile(r'(?<=tree\sid=")[^"]+')
+# Whitespace between tags, stripped before a StringTree is parsed.
+inter_tag_space_regex = re.compile(r'>\s+<')
+# The structure node in the preamble of a forest file.
+structure_node_regex = re.compile(r'<structure [^/>]+/>')
+
 class Error(Exception):
     """Errors in this class."""
     pass
@@ -100,66 +119,45 @@ class BaseForest(collections.UserList):
 # Methods to validate all trees when data is ADDED to the forest.
     
     def __setitem__(self, i, item):
-        try:
-            self.data[i] = StringTree(item)
-        except ValidationError as e:
-            print(e.xmlstring)
-            raise
+        self.data[i] = self._string_tree(item)
         
     def __add__(self, other):
-        try:
-            l = [StringTree(item) for item in list(other)]
-        except ValidationError as e:
-            print(e.xmlstring)
-            raise
+        l = [self._string_tree(item) for item in other]
         r = self.__class__(self.data + l)
         r.name = self.name
         r.structure_rules = self.structure_rules
         return r
             
     def __radd__(self, other):
-        try:
-            l = [StringTree(item) for item in list(other)]
-        except ValidationError as e:
-            print(e.xmlstring)
-            raise
+        l = [self._string_tree(item) for item in other]
         r = self.__class__(l + self.data)
         r.name = self.name
         r.structure_rules = self.structure_rules
         return r
         
     def __iadd__(self, other):
-        try:
-            l = [StringTree(item) for item in list(other)]
-        except ValidationError as e:
-            print(e.xmlstring)
-            raise
-        self.data += l
+        self.data += [self._string_tree(item) for item in other]
         return self
     
     def append(self, item):
-        try:
-            StringTree(item)
-        except ValidationError as e:
-            print(e.xmlstring)
-            raise
-        self.data.append(StringTree(item))
+        self.data.append(self._string_tree(item))
         
     def insert(self, i, item):
-        try:
-            StringTree(item)
-        except ValidationError as e:
-            print(e.xmlstring)
-            raise
-        self.data.insert(i, StringTree(item))
+        self.data.insert(i, self._string_tree(item))
         
     def extend(self, other):
+        self.data.extend([self._string_tree(item) for item in other])
+        
+    def _string_tree(self, item):
+        """Returns item as a StringTree. Items which are already StringTrees
+        were validated when they were created and are not parsed again."""
+        if isinstance(item, StringTree):
+            return item
         try:
-            l = [StringTree(item) for item in list(other)]
+            return StringTree(item)
         except ValidationError as e:
             print(e.xmlstring)
             raise
-        self.data.extend(l)
         
 # Non-list based methods.
         
@@ -186,30 +184,24 @@ class BaseForest(collections.UserList):
                     'list above.')
                 
     def _validate(self, string_tree):
-        tree = string_tree.to_base_tree()
+        structure = string_tree.get_structure()
         for key in self.structure_rules:
-            if key == 'knots':
-                prop = 'has_knots'
-            elif key == 'contacts':
-                prop = 'has_contacts'
-            else:
-                prop = key
             try:
-                val = eval('tree.' + prop + '()')
-            except:
-                print(prop)
+                val = structure[key]
+            except KeyError:
+                print(key)
                 raise
             if val != self.structure_rules[key]:
                 if (key == 'min_leaves_per_branch' and val < self.structure_rules[key]) \
                 or (key == 'max_leaves_per_branch' and val > self.structure_rules[key]):
                     x = 'Tree {} has a branch with {} leaves; violates BaseForest rules.'.format( \
-                    tree.documentElement.getAttribute('id'), str(val))
+                    structure['id'], str(val))
                     print(string_tree)
                     raise StructureError(x)
                 if key not in ['min_leaves_per_branch', 'max_leaves_per_branch'] \
                 and val == True and self.structure_rules[key] == False:
                     x = 'Tree {} has "{}"; violates BaseForest rules.'.format( \
-                    tree.documentElement.getAttribute('id'), key)
+                    structure['id'], key)
                     print(string_tree)
                     raise StructureError(x)
         
@@ -218,17 +210,17 @@ class BaseForest(collections.UserList):
         # Pre-validation can be disabled, but this should only be used for debugging.
         if validate:
             self.validate()
-        xml = '<?xml version="1.0" encoding="UTF-8"?>\n' if decl else ''
-        xml += '<forest name="{}">\n<header />\n{}<structure '.format(
+        parts = ['<?xml version="1.0" encoding="UTF-8"?>\n' if decl else '']
+        parts.append('<forest name="{}">\n<header />\n{}<structure '.format(
             self.name, self.the_map
-        )
-        xml += ' '.join([key + '="' + \
-        str(value).replace('True', 'Y').replace('False', 'N') + '"' \
-        for key, value in self.structure_rules.items()])
-        xml += '/>\n'
-        xml += '\n'.join([str(tree) for tree in self])
-        xml += '\n</forest>'
-        return xml
+        ))
+        parts.append(' '.join([key + '="' + \
+        ('Y' if value is True else 'N' if value is False else str(value)) + '"' \
+        for key, value in self.structure_rules.items()]))
+        parts.append('/>\n')
+        parts.append('\n'.join([tree.data for tree in self.data]))
+        parts.append('\n</forest>')
+        return ''.join(parts)
         
     def to_leaf_dict(self, leaf_id_only=False):
         """Convert all trees to a dictionary of dictionaries."""
@@ -257,63 +249,60 @@ class BaseForest(collections.UserList):
         By default, tree id and leaf id are combined; this can be disabled
         with add_t_id=False."""
         
-        regex_val = re.compile(
-            r'<(leaf|knot)[^>]*\sid\s*=\s*"([^"]+)"[^>]*\svalue\s*=\s*"([^"]+)"', 
-            re.MULTILINE
-        )
-        regex_ord = re.compile(
-            r'<(leaf|knot)[^>]*\sid\s*=\s*"[^"]+"[^>]*\sorder\s*=\s*"([0-9]+)"', 
-            re.MULTILINE
-        )
-        
-        tid_regex = re.compile(r'<tree[^>]*\sid="([^"]+)"')
-        
         tup_list = []
         for stree in self.data:
+            s = stree.data
             l = []
-            t_id = tid_regex.search(str(stree)).group(1)
+            t_id = tree_id_regex.search(s).group(1)
             id_prefix = t_id + '#' if not leaf_id_only else ''
-            m = regex_val.search(str(stree), 0)
-            while m:
-                m2 = regex_ord.search(str(stree), m.start())
-                l.append([m2.group(2), (id_prefix + m.group(2), m.group(3))])
-                m = regex_val.search(str(stree), m.end())
-            l.sort(key=lambda x: int(x[0]))
+            for m in terminal_regex.finditer(s):
+                attrs = dict(terminal_attr_regex.findall(m.group()))
+                # Terminals with an empty id or value are skipped.
+                if attrs.get('id') and attrs.get('value'):
+                    l.append((int(attrs['order']), 
+                        (id_prefix + attrs['id'], attrs['value'])))
+            l.sort(key=lambda x: x[0])
             tup_list.extend([x[1] for x in l])
             
         return tup_list
         
-    def build_map(self, remove_knots=False):
+    def build_map(self, remove_knots=False, validate=True):
         """Creates the 'map' element of the BaseForest, based on XML code 
         contained in the knots of the tree. If remove_knots is true,
-        simultaneously deletes the knots from the tree."""
-        self.the_map = '<map>\n'
+        simultaneously deletes the knots from the tree. If validate is
+        true, the map is only kept if it is well-formed XML."""
+        parts = ['<map>\n']
         for i, string_tree in enumerate(self.data):
             tree = string_tree.to_base_tree()
-            t_id = string_tree.get_id()
+            ptr = '<ptr target="#{}/'.format(string_tree.get_id())
             terminals = [l for l in tree.leaves]
             terminals.extend([k for k in tree.knots])
-            terminals = tree.order_nodes(terminals)
-            while terminals:
-                t = terminals.pop(0)
+            for t in tree.order_nodes(terminals):
                 if t.tagName == 'leaf':
-                    self.the_map += '<ptr target="#{}/{}"/>\n'.format(
-                        t_id, t.getAttribute('id')
-                    )
+                    parts.append(ptr + t.getAttribute('id') + '"/>\n')
                 else:
-                    self.the_map += xmlent_resolve(
+                    parts.append(xmlent_resolve(
                         t.getAttribute('value') + '\n'
-                    )
-            if remove_knots:
+                    ))
+            if remove_knots and tree.knots:
                 tree.del_nodes(tree.knots)
-                new_string_tree = tree.to_string_tree()
+                # Deleting knots only invalidates a tree if it leaves
+                # it with no leaves.
+                new_string_tree = tree.to_string_tree(not tree.leaves)
                 self.data[i] = new_string_tree
-        self.the_map += '</map>\n'
+        parts.append('</map>\n')
+        self.the_map = ''.join(parts)
         # Check that the map is well-formed XML (it may well not be...)
         # If not, don't include it in the file!
-        handler = xml.sax.handler.ContentHandler()
+        # Like toxml, the check can be disabled, but this should only be
+        # used if the knots are known to contain well-formed XML.
+        if not validate:
+            return
+        # A parser with no handlers set checks well-formedness without
+        # calling back into Python.
+        parser = xml.parsers.expat.ParserCreate()
         try:
-            parser = xml.sax.parseString(self.the_map.encode('utf-8'), handler)
+            parser.Parse(self.the_map.encode('utf-8'), True)
         except Exception as e:
             print('Map creation failed: Code in knots does not form valid XML.')
             with open('map', 'wb') as f:
@@ -322,31 +311,80 @@ class BaseForest(collections.UserList):
             
     def unique_terminal_ids(self, show_doublets=False):
         """Checks whether the terminal IDs in the forest are unique or not."""
-        ids = [x[0] for x in self.to_id_value_list(leaf_id_only=True)]
-        unique = list(set(ids))
-        if show_doublets: 
-            l = list(set([x for x in ids if ids.count(x) > 1]))
-            print(l)
-        return len(unique) == len(ids)
+        if show_doublets:
+            ids = list(self._iter_terminal_ids(leaf_id_only=True))
+            counts = collections.Counter(ids)
+            print([x for x, n in counts.items() if n > 1])
+            return len(counts) == len(ids)
+        # Stop at the first repeated ID.
+        seen = set()
+        for an_id in self._iter_terminal_ids(leaf_id_only=True):
+            if an_id in seen:
+                return False
+            seen.add(an_id)
+        return True
+        
+    def _iter_terminal_ids(self, leaf_id_only=False):
+        """Yields the IDs of the terminals listed by to_id_value_list, in
+        the order they appear in each tree's XML, not sorted by their 
+        order attribute."""
+        for stree in self.data:
+            s = stree.data
+            id_prefix = tree_id_regex.search(s).group(1) + '#' \
+            if not leaf_id_only else ''
+            for m in terminal_regex.finditer(s):
+                attrs = dict(terminal_attr_regex.findall(m.group()))
+                if attrs.get('id') and attrs.get('value'):
+                    yield id_prefix + attrs['id']
 
 class StringTree(collections.UserString):
     
-    def __init__(self, seq=default_tree_string):
+    def __init__(self, seq=default_tree_string, validate=True):
+        # validate=False should only be used for XML generated from a tree
+        # which is already known to be valid.
         if isinstance(seq, str):
             self.data = seq
         else:
             self.data = str(seq)
-        self.validate()
+        if validate:
+            self.validate()
 
     def get_id(self):
-        m = re.search(r'(?<=tree\sid=)"(.*?)"', self.data)
+        m = get_id_regex.search(self.data)
         if m.group(1):
             return m.group(1)
         else: 
             return ''
             
     def update_id(self, s):
-        re.sub(r'(?<=tree\sid=")[^"]+', s, self.data)
+        update_id_regex.sub(s, self.data)
+            
+    def get_structure(self):
+        """Returns a dictionary of the tree's structural properties, keyed
+        by the names of the BaseForest structure rules, plus the tree's 'id'.
+        The result is cached until self.data changes, so that the DOM is
+        only built once however often the forest is validated."""
+        try:
+            data, structure = self._structure
+            if data is self.data:
+                return structure
+        except AttributeError:
+            pass
+        tree = self.to_base_tree()
+        min_leaves, max_leaves = tree._branch_leaf_counts()
+        structure = {
+            'id': tree.documentElement.getAttribute('id'),
+            'contacts': tree.has_contacts(), 
+            'crossing_branches': tree.crossing_branches(),
+            'fallen_branches': tree.fallen_branches(),
+            'fallen_leaves': tree.fallen_leaves(),
+            'knots': tree.has_knots(),
+            'max_leaves_per_branch': max_leaves,
+            'min_leaves_per_branch': min_leaves,
+            'terminal_branches': tree.terminal_branches()
+        }
+        self._structure = (self.data, structure)
+        return structure
             
     def validate(self):
         """Class-internal SAX-based validation of trees loaded from XML
@@ -354,8 +392,14 @@ class StringTree(collections.UserString):
         If successful, returns the tree's unique ID.
         Otherwise, ValidationError will be raised."""
         handler = StringTreeContentHandler()
+        # The handler is driven by expat directly rather than through
+        # xml.sax, which adds a layer of Python calls to every event.
+        parser = xml.parsers.expat.ParserCreate()
+        parser.StartElementHandler = handler.startElement
+        parser.EndElementHandler = handler.endElement
         try:
-            parser = xml.sax.parseString(self.data.encode('utf-8'), handler)
+            parser.Parse(self.data.encode('utf-8'), True)
+            handler.endDocument()
         except ValidationError as e:
             with open('treedump', 'wb') as f:
                 pickle.dump(self.data, f)
@@ -367,7 +411,7 @@ class StringTree(collections.UserString):
             
     def to_base_tree(self):
         # Strip out all whitespace
-        clean = re.sub(r'>\s+<', '><', self.data)
+        clean = inter_tag_space_regex.sub('><', self.data)
         # Empty document
         tree = BaseTree()
         # Parse the text_tree into a real DOM object
@@ -381,124 +425,153 @@ class StringTree(collections.UserString):
         # Splits a very large StringTree into trees of max. 1000 tokens.
         # This immeasurably improves the performance of most tools.
         # At the moment, it can only work on trees without branches.
-        def ssearch():
-            nonlocal count, leaves, m, last_ix
-            # Start by searching only near last_ix
-            m = re.search(
-                '<(leaf|knot)[^>]*order="{}".*?(/>|</leaf>|</knot>)'.\
-                format(count + 1), 
-                self.data[last_ix:min(len(self.data), last_ix+1000)], re.DOTALL
-            )
-            
-            if not m:
-                # Search all self.data
-                m = re.search(
-                    '<(leaf|knot)[^>]*order="{}".*?(/>|</leaf>|</knot>)'.\
-                    format(count + 1), self.data, re.DOTALL
-                )
-                
-            if m:
-                count += 1
-                order_ix = m.group().find('order="') + 7
-                x = count % 1000 or 1000
-                leaves += m.group()[:order_ix] + str(x) + \
-                m.group()[order_ix + len(str(count)):] + '\n'
-                last_ix = m.end()
-                
-                
         if self.data.find('<branch') != -1:
             print('Tree contains branches; cannot split.')
             return [self]
             
-        trees, leaves, m = [], '', None
-        count = n = last_ix = 0
-        m = 'something'
-        while m:
-            n += 1
-            ssearch()
+        # Read all terminals in a single pass, then put them in text order.
+        terminals = sorted(
+            (int(m.group(2)), m.start(2) - m.start(), m.group())
+            for m in flat_terminal_regex.finditer(self.data)
+        )
+        # Renumber the terminals from 1 to 1000 within each new tree, stopping
+        # at the first gap in the orders.
+        leaves = []
+        for order, order_ix, s in terminals:
+            if order != len(leaves) + 1:
+                break
+            leaves.append(s[:order_ix] + str(order % 1000 or 1000) + \
+            s[order_ix + len(str(order)):] + '\n')
+            
+        # A tree with no terminals numbered from 1 still gives one (empty) 
+        # tree, so that callers don't silently drop it.
+        trees = []
+        for n in range(1, max(1, (len(leaves) + 999) // 1000) + 1):
             print('Group {} thousand items'.format(n))
-            while m and count % 1000 != 0: ssearch()
             trees.append(
                 '<tree id="{}">\n<trunk>\n{}\n</trunk></tree>'.format(
-                    self.get_id() + '_' + str(n), leaves
+                    self.get_id() + '_' + str(n), 
+                    ''.join(leaves[(n - 1) * 1000:n * 1000])
                 )
             )
-            leaves = ''
             
         return trees
     
 class BaseTree(xml.dom.minidom.Document):
 
+    # Next number to try in make_id
+    _next_id = 1
+    # True while _refresh_lists is deferred by batch()
+    _refresh_deferred = False
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager which defers _refresh_lists until the end of the
+        with block, so that many nodes can be added with new_leaf, new_knot,
+        new_branch and new_contact without walking the whole tree after
+        each one. Other methods which modify the tree rely on up-to-date
+        lists and should not be called inside the block."""
+        deferred = self._refresh_deferred
+        self._refresh_deferred = True
+        try:
+            yield self
+        finally:
+            self._refresh_deferred = deferred
+            self._refresh_lists()
+
     def _refresh_lists(self):
-        self.trunk = self.getElementsByTagName('trunk')[0]
-        self.leaves = self.getElementsByTagName('leaf')
-        self.knots = self.getElementsByTagName('knot')
-        self.contacts = self.getElementsByTagName('contact')
-        self.branches = self.getElementsByTagName('branch')
+        if self._refresh_deferred:
+            return
+        # Collect the trunk, leaves, knots, contacts and branches in a
+        # single walk over the tree rather than one walk per tag name.
+        lists = {
+            'trunk': xml.dom.minicompat.NodeList(),
+            'leaf': xml.dom.minicompat.NodeList(),
+            'knot': xml.dom.minicompat.NodeList(),
+            'contact': xml.dom.minicompat.NodeList(),
+            'branch': xml.dom.minicompat.NodeList()
+        }
+        def walk(node):
+            for child_node in node.childNodes:
+                if child_node.nodeType == xml.dom.Node.ELEMENT_NODE:
+                    l = lists.get(child_node.tagName)
+                    if l is not None:
+                        l.append(child_node)
+                    walk(child_node)
+        walk(self)
+        self.trunk = lists['trunk'][0]
+        self.leaves = lists['leaf']
+        self.knots = lists['knot']
+        self.contacts = lists['contact']
+        self.branches = lists['branch']
         nodes = self.leaves[:]
         nodes.extend(self.knots)
-        self._orders = [int(x.getAttribute('order')) for x in nodes]
+        # Stored as a compact array of C ints rather than a list of ints.
+        self._orders = array.array('i', 
+            [int(x.getAttribute('order')) for x in nodes])
         nodes.extend(self.branches[:])
         self.ids = set([x.getAttribute('id') for x in nodes])
+        self._refresh_attrs()
+        
+    def _refresh_attrs(self):
+        """Updates branch_attrs and leaf_attrs only, for changes which add
+        or remove attributes without adding or removing nodes."""
         try:
-            self.branch_attrs = [self.branches[0].attributes.item(i).nodeName 
-            for i in list(range(self.branches[0].attributes.length))]
+            self.branch_attrs = list(self.branches[0].attributes.keys())
         except IndexError:
             # No branches
             self.branch_attrs = ['id', 'relation']
         try:
-            self.leaf_attrs = [self.leaves[0].attributes.item(i).nodeName
-            for i in list(range(self.leaves[0].attributes.length))]
+            self.leaf_attrs = list(self.leaves[0].attributes.keys())
         except IndexError:
             # No leaves
             self.leaf_attrs = ['id', 'value', 'order', 'relation']
         
     def leafless_branches(self):
         for branch in self.branches:
-            if not self.get_child_leaves(branch):
+            if not self._has_children(branch, ['leaf', 'knot']):
                 return True
         return False
         
     def get_child_leaves(self, structure):
-        l = []
-        for child_node in structure.childNodes:
-            if child_node.localName in ['leaf', 'knot']:
-                l.append(child_node)
-        return l
+        return self._get_children(structure, ['leaf', 'knot'])
         
     def get_child_branches(self, structure):
-        l = []
-        for child_node in structure.childNodes:
-            if child_node.localName == 'branch':
-                l.append(child_node)
-        return l
+        return self._get_children(structure, ['branch'])
         
     def get_child_structures(self, structure):
-        l = []
-        for child_node in structure.childNodes:
-            if child_node.localName in ['branch', 'leaf', 'knot']:
-                l.append(child_node)
-        return l
+        return self._get_children(structure, ['branch', 'leaf', 'knot'])
         
     def get_contacts(self, structure):
-        l = []
+        return self._get_children(structure, ['contact'])
+        
+    def _get_children(self, structure, tag_names):
+        # Checks tagName rather than localName, which minidom recomputes
+        # (via a caught AttributeError) on every access for parsed elements.
+        return [child_node for child_node in structure.childNodes \
+            if child_node.nodeType == xml.dom.Node.ELEMENT_NODE \
+            and child_node.tagName in tag_names]
+        
+    def _has_children(self, structure, tag_names):
+        # As _get_children, but stops at the first match.
         for child_node in structure.childNodes:
-            if child_node.localName == 'contact':
-                l.append(child_node)
-        return l
+            if child_node.nodeType == xml.dom.Node.ELEMENT_NODE \
+            and child_node.tagName in tag_names:
+                return True
+        return False
         
     def get_id(self):
         return self.trunk.parentNode.getAttribute('id')
         
     def fallen_leaves(self):
-        return True if self.get_child_leaves(self) else False 
+        return self._has_children(self, ['leaf', 'knot'])
         
     def fallen_branches(self):
-        return True if self.get_child_branches(self) else False
+        return self._has_children(self, ['branch'])
         
     def terminal_branches(self):
         for branch in self.branches:
-            if not self.get_child_structures(branch):
+            if not self._has_children(branch, ['branch', 'leaf', 'knot']):
                 return True
         return False
         
@@ -509,45 +582,90 @@ class BaseTree(xml.dom.minidom.Document):
         return True if self.contacts else False
         
     def crossing_branches(self, track=False):
+        discontinuous = self._discontinuous_branches()
         for branch in self.branches:
-            if self._is_discontinuous(branch, track): return True
+            if discontinuous[branch]:
+                if track: self._is_discontinuous(branch, track)
+                return True
         return False
         
     def _is_discontinuous(self, node, track=False):
         terminals = node.getElementsByTagName('leaf')
         terminals.extend(node.getElementsByTagName('knot'))
+        if not terminals:
+            return False
         orders = [int(terminal.getAttribute('order')) for terminal in terminals]
-        orders.sort()
-        if orders and orders != list(range(orders[0], orders[-1] + 1)):
-            if track: print(orders, branch.getAttribute('id'))
+        # Orders are unique within a tree, so they are continuous if and only
+        # if they span exactly as many values as there are terminals.
+        if max(orders) - min(orders) != len(orders) - 1:
+            if track: print(sorted(orders), node.getAttribute('id'))
             return True
+        return False
         
-    def min_leaves_per_branch(self):
-        n = 9999
+    def _discontinuous_branches(self):
+        """Returns a dictionary mapping each branch in self.branches to True
+        if it is discontinuous (see _is_discontinuous), in a single walk over
+        the tree rather than one search per branch."""
+        discontinuous = {}
+        def walk(node):
+            # Returns lowest order, highest order and number of terminals
+            # dominated by node.
+            lo, hi, n = None, None, 0
+            for child_node in node.childNodes:
+                if child_node.nodeType != xml.dom.Node.ELEMENT_NODE:
+                    continue
+                if child_node.tagName in ['leaf', 'knot']:
+                    order = int(child_node.getAttribute('order'))
+                    c_lo, c_hi, c_n = order, order, 1
+                elif child_node.tagName in ['tree', 'trunk', 'branch']:
+                    c_lo, c_hi, c_n = walk(child_node)
+                    if not c_n:
+                        continue
+                else:
+                    continue
+                lo = c_lo if lo is None else min(lo, c_lo)
+                hi = c_hi if hi is None else max(hi, c_hi)
+                n += c_n
+            if node.nodeType == xml.dom.Node.ELEMENT_NODE \
+            and node.tagName == 'branch':
+                discontinuous[node] = n > 0 and hi - lo != n - 1
+            return lo, hi, n
+        walk(self)
+        # Branches detached from the tree since the last _refresh_lists
         for branch in self.branches:
-            i = 0
-            for child_node in branch.childNodes:
-                i += 1 if child_node.localName in ['leaf', 'knot'] else 0
-            n = min(n, i)
-        return n
+            if branch not in discontinuous:
+                walk(branch)
+        return discontinuous
+        
+    def min_leaves_per_branch(self):
+        return self._branch_leaf_counts()[0]
         
     def max_leaves_per_branch(self):
-        n = 0
+        return self._branch_leaf_counts()[1]
+        
+    def _branch_leaf_counts(self):
+        """Returns (min, max) of the number of leaves and knots which are
+        children of each branch, counted in a single pass. The minimum is
+        never more than 9999."""
+        counts = [9999]
         for branch in self.branches:
             i = 0
             for child_node in branch.childNodes:
-                i += 1 if child_node.localName in ['leaf', 'knot'] else 0
-            n = max(n, i)
-        return n
+                if child_node.nodeType == xml.dom.Node.ELEMENT_NODE \
+                and child_node.tagName in ['leaf', 'knot']:
+                    i += 1
+            counts.append(i)
+        return min(counts), max(counts[1:], default=0)
         
     def make_id(self, prefix = '', length = 4):
-        """Returns a random number of x characters not given in ID."""
-        import random
-        random.seed()
-        while True:
-            newId = prefix + str(random.randint(0, 10 ** length))
-            if newId not in self.ids:
-                return newId
+        """Returns prefix followed by a number, not given in ID. Numbers are
+        taken from a counter which only increases, so IDs are not reused 
+        within the tree. length is no longer used."""
+        n = self._next_id
+        while prefix + str(n) in self.ids:
+            n += 1
+        self._next_id = n + 1
+        return prefix + str(n)
                 
     def update_id(self, node, new_id):
         """Changes the ID on a specified node, including all idrefs."""
@@ -566,7 +684,6 @@ class BaseTree(xml.dom.minidom.Document):
         """Returns a list of nodes with attribute 'key' = 'value'.
         The 'ancestor' property permits specification of a common ancestor.
         The 'regex' property enables regex matching of value. """
-        import re
         if not ancestor:
             ancestor = self
         if not isinstance(value, str):
@@ -574,28 +691,28 @@ class BaseTree(xml.dom.minidom.Document):
                 value = str(value)
             except:
                 raise TypeError('"value" must be a string')
+        nodes = ancestor.getElementsByTagName('*')
         if regex:
-            return list(filter(lambda x: re.match(value, x.getAttribute(key)), \
-            ancestor.getElementsByTagName('*')))
+            match = re.compile(value).match
+            return [node for node in nodes if match(node.getAttribute(key))]
         else:
-            return list(filter(lambda x: x.getAttribute(key) == value, \
-            ancestor.getElementsByTagName('*')))
+            return [node for node in nodes if node.getAttribute(key) == value]
         
     def find_child_nodes(self, key, value, parent, regex=True):
         """Returns a list of child nodes with attribute 'key' = 'value'.
         The 'parent' property permits specification of the parent.
         The 'regex' property enables regex matching of value. """
-        import re
         l = []
         if not isinstance(value, str):
             try:
                 value = str(value)
             except:
                 raise TypeError('"value" must be a string')
+        match = re.compile(value).match if regex else None
         for child_node in parent.childNodes:
             if child_node.localName in ['leaf', 'knot', 'branch', 'contact']:
-                if child_node.getAttribute(key) == value or \
-                (regex and re.match(value, child_node.getAttribute(key))):
+                attr = child_node.getAttribute(key)
+                if attr == value or (match and match(attr)):
                     l.append(child_node)
         return l
         
@@ -622,7 +739,12 @@ class BaseTree(xml.dom.minidom.Document):
         # Add node to the trunk
         self.trunk.appendChild(new_node)
         # Update lists
-        self._refresh_lists()
+        if self._refresh_deferred:
+            # Keep new orders and IDs unique until the lists are refreshed.
+            self._orders.append(order)
+            self.ids.add(iid)
+        else:
+            self._refresh_lists()
         return new_node
         
     def new_branch(self, iid='', child_nodes = [], ignore_warnings = True):
@@ -640,7 +762,10 @@ class BaseTree(xml.dom.minidom.Document):
         # Add node to the trunk
         self.trunk.appendChild(new_node)
         # Update lists
-        self._refresh_lists()
+        if self._refresh_deferred:
+            self.ids.add(iid)
+        else:
+            self._refresh_lists()
         # Copy child nodes across
         # COMMON ERROR: pass a node not a node list, if only one child node
         # Correct this.
@@ -738,7 +863,7 @@ class BaseTree(xml.dom.minidom.Document):
             node.parentNode.appendChild(child_node)
             
         # remove the node
-        self._del_node(node)
+        self._del_nodes([node])
         return None
         
     def del_node_deep(self, node):
@@ -748,10 +873,8 @@ class BaseTree(xml.dom.minidom.Document):
             
         terminals = node.getElementsByTagName('leaf')
         terminals.extend(node.getElementsByTagName('knot'))
-        for leaf in terminals:
-            self._del_node(leaf)
-        # remove the node
-        self._del_node(node)
+        # remove the terminals and the node
+        self._del_nodes(terminals + [node])
         return None
         
     def del_contact(self, contact):
@@ -762,27 +885,8 @@ class BaseTree(xml.dom.minidom.Document):
         self._refresh_lists()
         return None
         
-    def _del_node(self, node):
-        if node.localName in ['leaf', 'knot']:
-            for leaf in self.leaves:
-                if int(leaf.getAttribute('order')) > int(node.getAttribute('order')):
-                    leaf.setAttribute('order', str(int(leaf.getAttribute('order')) - 1))
-                    
-            for knot in self.knots:
-                if int(knot.getAttribute('order')) > int(node.getAttribute('order')):
-                    knot.setAttribute('order', str(int(knot.getAttribute('order')) - 1))
-                    
-        for contact in self.contacts:
-            if contact.getAttribute('idref') == node.getAttribute('id'):
-                contact.parentNode.removeChild(contact)
-                contact.unlink()
-        node.parentNode.removeChild(node)
-        node.unlink()
-        self._refresh_lists()
-        
     def del_nodes(self, nodes):
         """Shallow deletes multiple nodes in a tree."""
-        orders = []
         for node in nodes:
             if not node.localName in ['branch', 'leaf', 'knot']:
                 raise ModifyTreeError('del_node cannot delete element "{}"'.format(node.localName))
@@ -795,30 +899,37 @@ class BaseTree(xml.dom.minidom.Document):
         return None
          
     def _del_nodes(self, nodes):
+        """Deletes nodes (and anything they still contain), renumbering the
+        remaining terminals and removing contacts to the deleted nodes in
+        a single pass over each, then refreshing the lists once."""
         lost_orders = []
-        lost_ids = []
+        lost_ids = set()
         for node in nodes:
             if node.localName in ['leaf', 'knot']:
                 lost_orders.append(int(node.getAttribute('order')))
-            lost_ids.append(node.getAttribute('id'))
-            
-            node.parentNode.removeChild(node)
-            node.unlink()
-        
+            lost_ids.add(node.getAttribute('id'))
         lost_orders.sort()
-        self._refresh_lists()
-        for l in [self.leaves, self.knots]:
-            for term in l:
-                order = int(term.getAttribute('order'))
-                i = 0
-                while i < len(lost_orders) and lost_orders[i] < order:
-                    i += 1
-                term.setAttribute('order', str(order - i))
+        lost_nodes = set(nodes)
         
+        # Contacts are removed first, while those inside deleted nodes are
+        # still attached to them.
         for contact in self.contacts:
             if contact.getAttribute('idref') in lost_ids:
                 contact.parentNode.removeChild(contact)
                 contact.unlink()
+                
+        for l in [self.leaves, self.knots]:
+            for term in l:
+                if term in lost_nodes:
+                    continue
+                order = int(term.getAttribute('order'))
+                i = bisect.bisect_left(lost_orders, order)
+                if i:
+                    term.setAttribute('order', str(order - i))
+                
+        for node in nodes:
+            node.parentNode.removeChild(node)
+            node.unlink()
         self._refresh_lists()
         
     def shuffle_leaf(self, node, new_order):
@@ -830,19 +941,17 @@ class BaseTree(xml.dom.minidom.Document):
             raise ModifyTreeError('For this sentence, new_order must be ' + \
             'between 1 and {} inclusive.'.format(len(self._orders)))
         old_order = int(node.getAttribute('order'))
+        # Only the terminals between the old and the new position move, 
+        # each by one place towards the old position.
+        if new_order > old_order:
+            low, high, shift = old_order + 1, new_order, -1
+        else:
+            low, high, shift = new_order, old_order - 1, 1
         for l in [self.leaves, self.knots]:
             for leaf in l:
                 leaf_order = int(leaf.getAttribute('order'))
-                if leaf_order < old_order and leaf_order < new_order:
-                    # Do nothing
-                    pass
-                elif leaf_order > old_order and leaf_order > new_order:
-                    # Do nothing
-                    pass
-                elif leaf_order > old_order: # <= new_order implicit
-                    leaf.setAttribute('order', str(int(leaf.getAttribute('order')) - 1))
-                elif leaf_order < old_order: # >= new_order implicit
-                    leaf.setAttribute('order', str(int(leaf.getAttribute('order')) + 1))
+                if low <= leaf_order <= high:
+                    leaf.setAttribute('order', str(leaf_order + shift))
         node.setAttribute('order', str(new_order))
         
     def restructure(self, **kwargs):
@@ -895,18 +1004,17 @@ class BaseTree(xml.dom.minidom.Document):
             
     def _no_terminal_branches(self):
         """Removes all terminal branches."""
-        x = self.branches[:]
-        while x:
-            branch = x.pop(0)
-            if not self.get_child_structures(branch):
-                self.del_node(branch)
+        # Deleting a terminal branch moves nothing, so they can all be
+        # deleted at once with a single refresh.
+        self.del_nodes([branch for branch in self.branches
+            if not self.get_child_structures(branch)])
                 
     def _no_contacts(self):
         """Removes all contacts."""
-        x = self.contacts[:]
-        while x:
-            contact = x.pop(0)
-            self.del_contact(contact)
+        for contact in self.contacts:
+            contact.parentNode.removeChild(contact)
+            contact.unlink()
+        self._refresh_lists()
             
     def _knot2leaf(self):
         """Converts all knots to leaves."""
@@ -926,39 +1034,36 @@ class BaseTree(xml.dom.minidom.Document):
     def _set_min_leaves_per_branch(self, minl):
         """USE WITH CAUTION: will remove all branches with less than the
         required number of leaves, moving child nodes to grandparents."""
-        stack = self.branches
-        while stack:
-            branch = stack.pop(0)
-            leaves = self.get_child_leaves(branch)
-            if len(leaves) < minl:
-                self.del_node(branch)
+        # Deleting a branch only moves its children up to its parent,
+        # which has already been checked, so the branches to delete can 
+        # all be found first and deleted with a single refresh.
+        self.del_nodes([branch for branch in self.branches
+            if len(self.get_child_leaves(branch)) < minl])
                 
     def _set_max_leaves_per_branch(self, maxl, minl=1):
         """USE WITH CAUTION: adds branches to contain smallest possible group of 
         leaves."""
         # print('set_max_leaves_per_branch called.')
         minl = 1 if minl < 1 else minl # must be at least 1 for this subroutine.
-        for branch in self.branches:
-            leaves = self.get_child_leaves(branch)
-            if len(leaves) > maxl:
-                # print('branch {} has {} leaves'.format(branch.getAttribute('id'), \
-                # len(leaves)))
-                leaves.sort(key=lambda x: x.getAttribute('order'))
-                for i in list(range(maxl, len(leaves), minl)):
-                    # print('i = {}'.format(i))
-                    child_nodes = leaves[i:i+minl] if len(leaves) > i+minl else leaves[i:]
-                    # print('Identified {} child_nodes'.format(len(child_nodes)))
-                    new_branch = self.new_branch(child_nodes=child_nodes, ignore_warnings=True)
-                    self.move_node_deep(new_branch, branch)
-                    new_branch.setAttribute('relation', '_PART')
+        with self.batch():
+            for branch in self.branches:
+                leaves = self.get_child_leaves(branch)
+                if len(leaves) > maxl:
+                    # print('branch {} has {} leaves'.format(branch.getAttribute('id'), \
+                    # len(leaves)))
+                    leaves.sort(key=lambda x: int(x.getAttribute('order')))
+                    for i in list(range(maxl, len(leaves), minl)):
+                        # print('i = {}'.format(i))
+                        child_nodes = leaves[i:i+minl] if len(leaves) > i+minl else leaves[i:]
+                        # print('Identified {} child_nodes'.format(len(child_nodes)))
+                        new_branch = self.new_branch(child_nodes=child_nodes, ignore_warnings=True)
+                        self.move_node_deep(new_branch, branch)
+                        new_branch.setAttribute('relation', '_PART')
                     
     def _no_crossing_branches(self):
-        blacklist = []
-        for branch in self.branches:
-            if self._is_discontinuous(branch):
-                blacklist.append(branch)
-        for node in blacklist:
-            self.del_node(node)
+        discontinuous = self._discontinuous_branches()
+        blacklist = [branch for branch in self.branches if discontinuous[branch]]
+        self.del_nodes(blacklist)
                     
     def format_conll(self):
         """Creates a CoNLL compatible tree structure:
@@ -1056,7 +1161,7 @@ class BaseTree(xml.dom.minidom.Document):
     def _remove_attr(self, node_list, attr):
         for node in node_list:
             node.removeAttribute(attr)
-        self._refresh_lists()
+        self._refresh_attrs()
         
     def add_branch_attr(self, attr):
         """Adds new branch attr to the tree."""
@@ -1068,12 +1173,23 @@ class BaseTree(xml.dom.minidom.Document):
         if attr not in self.leaf_attrs:
             self._add_attr(self.leaves, attr)
             
+    def add_leaf_attrs(self, attrs):
+        """Adds several new leaf attrs to the tree, refreshing only once."""
+        attrs = [attr for attr in attrs if attr not in self.leaf_attrs]
+        if attrs:
+            self._add_attrs(self.leaves, attrs)
+            
     def _add_attr(self, node_list, attr):
-        if not is_valid_attr(attr):
-            raise ModifyTreeError('Attribute name "{}" is not valid'.format(attr))
+        self._add_attrs(node_list, [attr])
+        
+    def _add_attrs(self, node_list, attrs):
+        for attr in attrs:
+            if not is_valid_attr(attr):
+                raise ModifyTreeError('Attribute name "{}" is not valid'.format(attr))
         for node in node_list:
-            node.setAttribute(attr, '--')
-        self._refresh_lists()
+            for attr in attrs:
+                node.setAttribute(attr, '--')
+        self._refresh_attrs()
         
     def get_target(self, node):
         """Returns the target node of a contact."""
@@ -1082,11 +1198,13 @@ class BaseTree(xml.dom.minidom.Document):
         x = self.find_nodes('id', node.getAttribute('idref'), regex=False)
         return x[0]
                     
-    def to_string_tree(self):
+    def to_string_tree(self, validate=True):
         """Returns XML of tree as string without declaration."""
-        return StringTree(self.toprettyxml()[22:])
+        return StringTree(self.toprettyxml()[22:], validate)
         
 class StringTreeContentHandler(xml.sax.handler.ContentHandler):
+    """Validates a single tree. attrs may be a SAX Attributes object or
+    the dictionary passed by expat."""
     
     def __init__(self):
         self.trunks = 0
@@ -1100,86 +1218,68 @@ class StringTreeContentHandler(xml.sax.handler.ContentHandler):
         self._current_hierarchy = []
         self.structure_ids = []
         self.structure_idrefs = []
-        self.orders = []
+        self.orders = set()
         self.num_leaves_knots = 0
         
     def startElement(self, name, attrs):
         if name == 'tree':
             if len(self.parent_child) > 0:
                 raise ValidationError('<tree /> is not parent element')
-            self.tree_attrs = attrs.getNames()
-            if 'id' not in self.tree_attrs:
+            self.tree_attrs = list(attrs.keys())
+            if 'id' not in attrs:
                 raise ValidationError('<tree /> missing required attribute "id".')
-            self.tree_id = attrs.getValue('id')
+            self.tree_id = attrs['id']
         
         elif name == 'trunk':
             self.trunks += 1
-            if attrs.getLength() > 0:
+            if len(attrs) > 0:
                 raise ValidationError('Error in tree ' + str(self.tree_id) + ': ' \
                 + '<trunk /> must not have attributes.')
                 
         elif name == 'branch':
             for attr in ['id', 'relation']:
-                if attr not in attrs.getNames():
+                if attr not in attrs:
                     raise ValidationError('Error in tree ' + str(self.tree_id) \
                     + ': <branch /> missing required attribute "' + attr + '".')
-            for attr in attrs.getNames():
+            for attr in attrs.keys():
                 if attr not in self.branch_attrs:
                     self.branch_attrs.append(attr)
-            self.structure_ids.append(attrs.getValue('id'))
+            self.structure_ids.append(attrs['id'])
                     
         elif name == 'leaf':
             for attr in ['id', 'order', 'relation', 'value']:
-                if attr not in attrs.getNames():
+                if attr not in attrs:
                     raise ValidationError('Error in tree ' + str(self.tree_id) \
                     + ': <leaf /> missing required attribute "' + attr + '".')
-            try:
-                x = int(attrs.getValue('order'))
-            except ValueError:
-                raise ValidationError('Error in tree ' + str(self.tree_id) \
-                + ': ' + name + ' id ' + str(attrs.getValue('id')) + \
-                ' has non-integer order attribute.')
-            if x in self.orders:
-                raise ValidationError('Error in tree ' + str(self.tree_id) \
-                + ': more than one element with order ' + str(x) + '.')
-            self.orders.append(x)
-            for attr in attrs.getNames():
+            self._add_order(name, attrs)
+            for attr in attrs.keys():
                 if attr not in self.leaf_attrs:
                     self.leaf_attrs.append(attr)
-            self.structure_ids.append(attrs.getValue('id'))
+            self.structure_ids.append(attrs['id'])
             self.num_leaves_knots += 1
 
                     
         elif name == 'knot':
             for attr in ['id', 'order', 'value']:
-                if attr not in attrs.getNames():
+                if attr not in attrs:
                     raise ValidationError('Error in tree ' + str(self.tree_id) \
                     + ': <knot /> missing required attribute "' + attr + '".')
-            for attr in attrs.getNames():
+            for attr in attrs.keys():
                 if attr not in self.knot_attrs:
                     self.knot_attrs.append(attr)
-            self.structure_ids.append(attrs.getValue('id'))
-            try:
-                x = int(attrs.getValue('order'))
-            except ValueError:
-                raise ValidationError('Error in tree ' + str(self.tree_id) \
-                + ': ' + name + ' id ' + str(attrs.getValue('id')) + \
-                ' has non-integer order attribute.')
-            if x in self.orders:
-                raise ValidationError('Error in tree ' + str(self.tree_id) \
-                + ': more than one element with order ' + str(x) + '.')
-            self.orders.append(x)
+            self.structure_ids.append(attrs['id'])
+            self._add_order(name, attrs)
             self.num_leaves_knots += 1
                     
         elif name == 'contact':
             for attr in ['idref', 'type']:
-                if attr not in attrs.getNames():
+                if attr not in attrs:
                     raise ValidationError('Error in tree ' + str(self.tree_id) \
                     + ': <contact /> missing required attribute "' + attr + '".')
-            for attr in attrs.getNames():
+            for attr in attrs.keys():
                 if attr not in self.contact_attrs:
                     self.contact_attrs.append(attr)
-            self.structure_idrefs.append(attrs.getValue('idref'))
+            self.structure_idrefs.append(attrs['idref'])
                     
         else:
             raise ValidationError('Error in tree ' + str(self.tree_id) \
@@ -1190,6 +1290,18 @@ class StringTreeContentHandler(xml.sax.handler.ContentHandler):
             self.parent_child.append((self._current_hierarchy[-2], \
             self._current_hierarchy[-1]))
             
+    def _add_order(self, name, attrs):
+        try:
+            x = int(attrs['order'])
+        except ValueError:
+            raise ValidationError('Error in tree ' + str(self.tree_id) \
+            + ': ' + name + ' id ' + str(attrs['id']) + \
+            ' has non-integer order attribute.')
+        if x in self.orders:
+            raise ValidationError('Error in tree ' + str(self.tree_id) \
+            + ': more than one element with order ' + str(x) + '.')
+        self.orders.add(x)
+            
     def endElement(self, name):
         del self._current_hierarchy[-1]
         
@@ -1207,21 +1319,23 @@ class StringTreeContentHandler(xml.sax.handler.ContentHandler):
                 raise ValidationError('Error in tree ' + str(self.tree_id) \
                 + ': ' + relation[0] + ' dominates ' + relation[1] + '.')
                 
-        if len(self.structure_ids) != len(set(self.structure_ids)):
+        ids = set(self.structure_ids)
+        if len(self.structure_ids) != len(ids):
+            counts = collections.Counter(self.structure_ids)
             for an_id in self.structure_ids:
-                if self.structure_ids.count(an_id) > 1:
+                if counts[an_id] > 1:
                     raise ValidationError('Error in tree ' + str(self.tree_id) \
                     + ': element id ' + str(an_id) + ' used by ' + \
-                    str(self.structure_ids.count(an_id)) + ' elements.')
+                    str(counts[an_id]) + ' elements.')
                     
         for an_idref in self.structure_idrefs:
-            if an_idref not in self.structure_ids:
+            if an_idref not in ids:
                 raise ValidationError('Error in tree ' + str(self.tree_id) \
                 + ': idref ' + str(an_idref) + ' matches no element.')
                 
-        self.orders.sort()
-                
-        if self.orders != list(range(len(self.orders) + 1))[1:]:
+        # Orders are unique, so they are continuous iff they run from 1 to n.
+        if self.orders and (min(self.orders) != 1 \
+        or max(self.orders) != len(self.orders)):
             raise ValidationError('Error in tree ' + str(self.tree_id) \
             + ': order attributes do not form a continuous sequence.')
             
@@ -1280,44 +1394,23 @@ def _parse_file(f):
     decl = str(f.readline(), 'utf-8')
     x = decl.index('"', decl.index('encoding')) + 1
     codec = decl[x:decl.index('"', x)].lower()
-    # Set up to read file.
+    # Decode the rest of the file in one go and split it at the start of
+    # each tree, rather than splitting it line by line.
+    text = decl.split('?>')[1] + str(f.read(), codec)
+    segments = text.split('<tree')
+    preamble = segments[0]
     part_tree = ''
-    in_tree = False
-    in_preamble = True
-    in_the_map = False
-    preamble = ''
-    # Parseline subfunction
-    def _parse_line(s):
-        nonlocal in_tree, in_preamble, preamble, part_tree, data
-        start_trees = s.split('<tree')
-        for i, string in enumerate(start_trees):
-            if in_preamble and i == 0:
-                preamble += string
-            # add '<tree' element back again
-            if i > 0:
-                string = '<tree' + string
-                in_tree = True
-                in_preamble = False
-            # re-split segment at end tags
-            x = string.rsplit('</tree>', 1)
-            if len(x) == 1 and in_tree:
-                part_tree += x[0]
-            elif len(x) == 2 and in_tree:
-                part_tree += x[0]
-                data.append(part_tree + '</tree>')
-                in_tree = False
-                part_tree = ''
-    _parse_line(decl.split('?>')[1])
-    # Read subsequent lines of file line by line.
-    # Concatenate lines to give a single string for each tree.
-    for line in f:
-        # convert bytes to string
-        s = str(line, codec)
-        _parse_line(s)
+    for segment in segments[1:]:
+        # Anything after the end tag, up to the next tree, is discarded.
+        x = ('<tree' + segment).rsplit('</tree>', 1)
+        part_tree += x[0]
+        if len(x) == 2:
+            data.append(part_tree + '</tree>')
+            part_tree = ''
     # Create the forest.
     forest = BaseForest()
     # Parse the Structure node using BaseForestStructureReader.
-    m = re.search(r'<structure [^/>]+/>', preamble)
+    m = structure_node_regex.search(preamble)
     if m:
         handler = BaseForestStructureReader()
         parser = xml.sax.parseString(m.group(), handler)
@@ -3,6 +3,9 @@
 
 import string, re
 
+# Splits a Penn tree into brackets and the text between them.
+BRACKET_SPLIT_REGEX = re.compile(r'([()])')
+
 class Parser():
     # Class from which all parsers inherit
     
@@ -327,16 +330,18 @@ class PennPsd(Parser):
         buff = ''
         id_count = 0
         
-        # Create listnest
-        for char in self.last_tree:
-            if char in '()':
+        # Create listnest. Splitting on the brackets hands write_d the text
+        # between them in one piece, rather than building buff up a
+        # character at a time.
+        for chunk in BRACKET_SPLIT_REGEX.split(self.last_tree):
+            if chunk == '(':
                 d = write_d()
-                if char == '(':
-                    self._bn_down(d)
-                elif char == ')':
-                    self._bn_up(d)
+                self._bn_down(d)
+            elif chunk == ')':
+                d = write_d()
+                self._bn_up(d)
             else:
-                buff += char
+                buff += chunk
         
         # Process found_list for contacts
         self._found_list(found_list)